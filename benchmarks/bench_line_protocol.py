@@ -0,0 +1,157 @@
+"""Compare Point.to_line_protocol against the precompiled LineSerializers for Solarman and Met Office data.
+
+    python benchmarks/bench_line_protocol.py
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+from influxdb_client import Point, WritePrecision
+
+from common import load_script, timeit
+
+solarman = load_script("solarman-scraper")
+weather = load_script("weather-scraper")
+
+DAYS = 30
+# Escaped characters in tags, to check output matches Point's
+PLANT_ID = "plant 1,a=b"
+DEVICE_SN = "SN=123\\"
+
+
+def solarman_day(day_start, rng):
+    keys = list(solarman.DAY_DETAIL_FIELDS)
+    rows = []
+    for n in range(288):
+        data_list = [{"key": key, "value": str(round(rng.uniform(-5000, 5000), rng.choice([0, 1, 3]))),
+                      "unit": rng.choice(["W", "kWh", "%"])}
+                     for key in keys if rng.random() < 0.95]
+        rows.append({"collectTime": str(int(day_start.timestamp()) + n * 300), "dataList": data_list})
+    return {"deviceSn": DEVICE_SN, "paramDataList": rows}
+
+
+def solarman_month(rng):
+    rows = [{"collectTime": f"2024-01-{day:02d}",
+             "dataList": [{"key": key, "value": str(round(rng.uniform(0, 50), 1)), "unit": "kWh"}
+                          for key in solarman.DAY_SUMMARY_FIELDS]}
+            for day in range(1, 32)]
+    return {"deviceSn": DEVICE_SN, "paramDataList": rows}
+
+
+def met_office_forecast(measurement_name, rng):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    time_series = []
+    for n in range(48):
+        entry = {"time": (start + timedelta(hours=n)).strftime("%Y-%m-%dT%H:%MZ")}
+        for key, field_type in weather.FIELDS[measurement_name].items():
+            if rng.random() < 0.9:
+                entry[key] = field_type(rng.uniform(0, 100))
+        time_series.append(entry)
+    return {"features": [{"properties": {"timeSeries": time_series}}]}
+
+
+def day_chart_points(plant_id, day_data):
+    # The Point-based serialization that DAY_DETAIL_LINES replaced
+    points = []
+    for ts_entry in day_data["paramDataList"]:
+        data = {d["key"]: (float(d["value"])/1000.0 if d.get("unit") == 'W' else float(d["value"]))
+                for d in ts_entry["dataList"]
+                if d["key"] in solarman.DAY_DETAIL_FIELDS and "value" in d}
+        ts = datetime.utcfromtimestamp(int(ts_entry['collectTime']))
+        point = Point("solarman").tag("plant_id", plant_id).tag("device_sn", day_data["deviceSn"]).time(ts, WritePrecision.S)
+        for data_key, write_key in solarman.DAY_DETAIL_FIELDS.items():
+            point.field(write_key, data.get(data_key, 0.0))
+        battery_charge_discharge = data.get('Pcg_dcg1', 0.0)
+        if battery_charge_discharge > 0:
+            point.field('energy_batter_in', battery_charge_discharge)
+            point.field('energy_batter_out', 0.0)
+        else:
+            point.field('energy_batter_in', 0.0)
+            point.field('energy_batter_out', battery_charge_discharge)
+        grid_power = data.get('PG_Pt1', 0.0)
+        if grid_power > 0:
+            point.field('power_buy', 0.0)
+            point.field('power_sell', grid_power)
+        else:
+            point.field('power_buy', -grid_power)
+            point.field('power_sell', 0.0)
+        points.append(point)
+    return [point.to_line_protocol() for point in points]
+
+
+def daily_summary_points(plant_id, month_data):
+    points = []
+    for day_summary in month_data["paramDataList"]:
+        data = {d["key"]: (float(d["value"])/1000 if d.get("unit") == 'W' else float(d["value"]))
+                for d in day_summary["dataList"]
+                if d["key"] in solarman.DAY_SUMMARY_FIELDS and "value" in d}
+        point = Point("solarman_daily_summary").tag("plant_id", plant_id).tag("device_sn", month_data["deviceSn"]) \
+            .time(datetime.fromisoformat(day_summary["collectTime"]), WritePrecision.S)
+        for data_key, write_key in solarman.DAY_SUMMARY_FIELDS.items():
+            point.field(write_key, data.get(data_key, 0.0))
+        points.append(point)
+    return [point.to_line_protocol() for point in points]
+
+
+def met_office_points(measurement_name, data):
+    points = []
+    for ts_entry in data["features"][0]["properties"]["timeSeries"]:
+        ts = datetime.strptime(ts_entry["time"], "%Y-%m-%dT%H:%M%z")
+        point = Point(measurement_name).tag("location", "Little Snoring").time(ts, WritePrecision.S)
+        for key, field_type in weather.FIELDS[measurement_name].items():
+            point.field(key, field_type(ts_entry.get(key, 0)))
+        points.append(point)
+    return [point.to_line_protocol() for point in points]
+
+
+class CapturePipeline:
+
+    def __init__(self):
+        self.lines = []
+
+    def write_lines(self, bucket, precision, lines):
+        self.lines.extend(lines)
+
+
+def serialized(write):
+    pipeline = CapturePipeline()
+    write(pipeline)
+    return pipeline.lines
+
+
+def main():
+    rng = random.Random(1)
+    days = [solarman_day(datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(n), rng) for n in range(DAYS)]
+    month = solarman_month(rng)
+    forecasts = {name: met_office_forecast(name, rng) for name in weather.FIELDS}
+
+    def solarman_lines(pipeline):
+        writer = solarman.InfluxDBWriter(pipeline)
+        for day_data in days:
+            writer.write_day_chart_data(PLANT_ID, day_data)
+
+    def summary_lines(pipeline):
+        solarman.InfluxDBWriter(pipeline).write_daily_summary_data(PLANT_ID, month)
+
+    def forecast_lines(pipeline):
+        writer = weather.InfluxDBWriter(pipeline)
+        for name, data in forecasts.items():
+            writer.write_data(name, "Little Snoring", data)
+
+    cases = [
+        (f"Solarman day detail, {DAYS} days", solarman_lines,
+         lambda: [line for day_data in days for line in day_chart_points(PLANT_ID, day_data)]),
+        ("Solarman daily summary, 1 month", summary_lines, lambda: daily_summary_points(PLANT_ID, month)),
+        ("Met Office forecasts", forecast_lines,
+         lambda: [line for name, data in forecasts.items() for line in met_office_points(name, data)]),
+    ]
+    for name, write, reference in cases:
+        lines = serialized(write)
+        assert lines == reference(), name
+        before = timeit(reference)
+        after = timeit(lambda: serialized(write))
+        print(f"{name} ({len(lines)} points): Point {before * 1000:8.1f} ms, "
+              f"LineSerializer {after * 1000:8.1f} ms ({before / after:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""End-to-end scrape cycles against local stand-ins for each API and for InfluxDB, with results written as JSON.
+
+    python benchmarks/bench_scrapers.py [--output results.json] [--cycles 5] [--latency-ms 0] [scraper ...]
+
+Each scraper runs in its own process, so that its peak RSS isn't mixed up with the stand-ins' or other scrapers'.
+The stand-in servers run in this process and serve synthetic payloads from fixtures.py. For each process_* method
+the cycle time includes flushing its points to the InfluxDB stand-in; allocations are measured with tracemalloc
+on one extra cycle, so they don't slow the timed ones. The Kia scraper isn't included, its API is behind a
+third-party library.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+from common import REPO_DIR, load_script
+import fixtures
+from standins import InfluxDBStandIn, StandIn, paged, route_hosts
+
+SCRAPERS = ["solarman-scraper", "zappi-scraper", "octopus-scraper", "weather-scraper"]
+
+SOLARMAN_INVERTERS = ["INV0001", "INV0002"]
+ZAPPI_SERIAL = 12345678
+ZAPPI_ASN = "s18.myenergi.net"
+OCTOPUS_ACCOUNT = "A-1234ABCD"
+OCTOPUS_TARIFF = "E-1R-AGILE-FLEX-22-11-25-C"
+OCTOPUS_GAS_TARIFF = "G-1R-VAR-22-11-01-C"
+OCTOPUS_USAGE_DAYS = 30
+OCTOPUS_RATE_DAYS = 90
+
+
+def json_bytes(payload):
+    return json.dumps(payload).encode()
+
+
+JSON = {"Content-Type": "application/json"}
+
+
+def solarman_stand_in(rng, latency):
+    today = date.today()
+    days = {device_sn: json_bytes(fixtures.solarman_day(device_sn, today, rng)) for device_sn in SOLARMAN_INVERTERS}
+    months = {device_sn: json_bytes(fixtures.solarman_month(device_sn, today.replace(day=1), today, rng))
+              for device_sn in SOLARMAN_INVERTERS}
+    devices = json_bytes({"deviceListItems": [{"deviceId": n, "deviceSn": device_sn, "deviceType": "INVERTER"}
+                                              for n, device_sn in enumerate(SOLARMAN_INVERTERS)]})
+
+    def handle(method, path, query, body):
+        if path == "/account/v1.0/token":
+            return 200, JSON, json_bytes({"access_token": "token", "expires_in": "5183999"})
+        if path == "/station/v1.0/device":
+            return 200, JSON, devices
+        if path == "/station/v1.0/realTime":
+            return 200, JSON, json_bytes(fixtures.solarman_snapshot(rng, datetime.now(tz=timezone.utc)))
+        if path == "/device/v1.0/historical":
+            request = json.loads(body)
+            return 200, JSON, (days if request["timeType"] == 1 else months)[request["deviceSn"]]
+        return 404, {}, b""
+
+    return {"globalapi.solarmanpv.com": StandIn(handle, latency)}
+
+
+def zappi_stand_in(rng, latency):
+    day = json_bytes({f"U{ZAPPI_SERIAL}": fixtures.zappi_day(date.today(), rng)})
+
+    def handle(method, path, query, body):
+        if path == "/":
+            return 200, {"X_MYENERGI-asn": ZAPPI_ASN}, b""
+        if path == "/cgi-jstatus-Z":
+            return 200, JSON, json_bytes(fixtures.zappi_status(ZAPPI_SERIAL, datetime.now(tz=timezone.utc), rng))
+        if path.startswith(f"/cgi-jday-Z{ZAPPI_SERIAL}-"):
+            return 200, JSON, day
+        return 404, {}, b""
+
+    stand_in = StandIn(handle, latency)
+    return {"director.myenergi.net": stand_in, ZAPPI_ASN: stand_in}
+
+
+def octopus_stand_in(rng, latency):
+    midnight = datetime.combine(date.today(), datetime.min.time(), tzinfo=timezone.utc)
+    rates = fixtures.agile_rates(midnight - timedelta(OCTOPUS_RATE_DAYS), midnight + timedelta(1))
+    gas_rates = [{"value_exc_vat": 6.0, "value_inc_vat": 6.3, "valid_from": "2020-01-01T00:00:00Z", "valid_to": None,
+                  "payment_method": None}]
+    usage = fixtures.octopus_consumption(midnight - timedelta(OCTOPUS_USAGE_DAYS), midnight, rng)
+    account = json_bytes(fixtures.octopus_account(OCTOPUS_ACCOUNT, OCTOPUS_TARIFF, OCTOPUS_GAS_TARIFF))
+    base_url = "https://api.octopus.energy"
+
+    def since(records, query):
+        # period_from is "YYYY-MM-DD HH:MM", comparable with the records' ISO timestamps once the T is swapped in
+        period_from = query.get("period_from", [""])[0].replace(" ", "T")
+        return [record for record in records if record["valid_from"] >= period_from]
+
+    def handle(method, path, query, body):
+        if path == f"/v1/accounts/{OCTOPUS_ACCOUNT}/":
+            return 200, JSON, account
+        if path.endswith("/standard-unit-rates/"):
+            results = since(gas_rates if "/gas-tariffs/" in path else rates, query)
+            return 200, JSON, json_bytes(paged(results, query, base_url, path))
+        if path.endswith("/consumption/"):
+            return 200, JSON, json_bytes(paged(usage, query, base_url, path))
+        return 404, {}, b""
+
+    return {"api.octopus.energy": StandIn(handle, latency)}
+
+
+def met_office_stand_in(rng, latency):
+    weather = load_script("weather-scraper")
+    model_run = datetime.now(tz=timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+    steps = {"hourly": (49, timedelta(hours=1)), "three-hourly": (56, timedelta(hours=3)),
+             "daily": (8, timedelta(days=1))}
+    forecasts = {path: json_bytes(fixtures.met_office_forecast(weather.FIELDS[path], model_run, *steps[path], rng))
+                 for path in weather.FIELDS}
+    model_run_date = model_run.strftime("%Y-%m-%dT%H:%MZ").encode()
+    runs = iter(range(1, 1000000))
+
+    def handle(method, path, query, body):
+        forecast = forecasts.get(path.rsplit("/", 1)[-1])
+        if forecast is None:
+            return 404, {}, b""
+        # A new model run each time, so the scraper writes every response
+        new_run = (model_run + timedelta(hours=next(runs))).strftime("%Y-%m-%dT%H:%MZ").encode()
+        return 200, JSON, forecast.replace(model_run_date, new_run)
+
+    return {"data.hub.api.metoffice.gov.uk": StandIn(handle, latency)}
+
+
+STAND_INS = {
+    "solarman-scraper": solarman_stand_in,
+    "zappi-scraper": zappi_stand_in,
+    "octopus-scraper": octopus_stand_in,
+    "weather-scraper": met_office_stand_in,
+}
+
+
+def scraper_config(influxdb_url, workdir):
+    return {
+        "influxdb": {
+            "url": influxdb_url, "token": "token", "org": "org",
+            "spool_path": os.path.join(workdir, "spool"),
+            # Every cycle rewrites the same fixtures; without this only the first cycle would write anything
+            "change_cache_size": 0,
+        },
+        "checkpoints": {"path": os.path.join(workdir, "checkpoints.db")},
+        "solarman": {
+            "login": {"client_id": "id", "client_secret": "secret", "email": "user@example.com", "password": "pw"},
+            "plant": {"plant_id": 1, "timezone": "Europe/London"},
+            "session_cache": os.path.join(workdir, "session.json"),
+        },
+        "myenergi": {"hub_serial": "10000000", "hub_password": "pw"},
+        "octopus": {"key": "key", "account": OCTOPUS_ACCOUNT, "rate_cache": os.path.join(workdir, "rates.json")},
+        "met_office": {"location": "London", "longitude": 0.0, "latitude": 51.1, "credentials": {"apikey": "key"}},
+    }
+
+
+def scenarios(name, scraper):
+    """(name, cycle) for each process_* method benchmarked for a scraper."""
+    if name == "solarman-scraper":
+        return [("process_snapshot", scraper.process_snapshot),
+                ("process_day", lambda: scraper.process_day(date.today(), full=True)),
+                ("process_month", lambda: scraper.process_month(date.today()))]
+    if name == "zappi-scraper":
+        return [("process_snapshot", scraper.process_snapshot),
+                ("process_day", lambda: scraper.process_day(date.today()))]
+    if name == "octopus-scraper":
+        return [("get_account_info", scraper.get_account_info),
+                ("process_snapshot", lambda: scraper.process_snapshot(resync_days=OCTOPUS_USAGE_DAYS))]
+    if name == "weather-scraper":
+        return [("process_snapshot", scraper.process_snapshot)]
+    raise KeyError(name)
+
+
+def measure(pipeline, cycle, cycles):
+    durations = []
+    points = []
+    for _ in range(cycles):
+        written = pipeline.stats()["points_written"]
+        start = time.perf_counter()
+        cycle()
+        pipeline.flush()
+        durations.append(time.perf_counter() - start)
+        points.append(pipeline.stats()["points_written"] - written)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    cycle()
+    pipeline.flush()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    growth = [stat for stat in after.compare_to(before, "filename") if stat.size_diff > 0]
+
+    return {
+        "cycles": cycles,
+        "cycle_seconds": {"min": min(durations), "mean": statistics.mean(durations), "max": max(durations)},
+        "points_per_cycle": max(points),
+        "points_per_second": sum(points) / sum(durations),
+        "alloc_peak_bytes": peak,
+        "alloc_retained_bytes": sum(stat.size_diff for stat in growth),
+        "alloc_retained_blocks": sum(stat.count_diff for stat in growth),
+    }
+
+
+def run_scraper(name, hosts, influxdb_url, cycles):
+    """Benchmark one scraper in this process, against stand-ins already running at the given URLs."""
+    route_hosts(hosts)
+    module = load_script(name)
+    logging.getLogger().setLevel(logging.WARNING)
+    scraper_class = getattr(module, {"solarman-scraper": "SolarmanScraper", "zappi-scraper": "ZappiScraper",
+                                     "octopus-scraper": "OctopusScraper", "weather-scraper": "MetOfficeScraper"}[name])
+    with tempfile.TemporaryDirectory() as workdir:
+        config = scraper_config(influxdb_url, workdir)
+        from influxdb_writer import WritePipeline
+        pipeline = WritePipeline(config["influxdb"])
+        start = time.perf_counter()
+        scraper = scraper_class(config, pipeline)
+        if name == "octopus-scraper":
+            scraper.start()
+        startup = time.perf_counter() - start
+        results = {scenario: measure(pipeline, cycle, cycles) for scenario, cycle in scenarios(name, scraper)}
+        pipeline.close()
+    return {
+        "startup_seconds": startup,
+        # Linux reports ru_maxrss in KiB
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "scenarios": results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scrapers", nargs="*", metavar="scraper", help="Scrapers to run (default: all)")
+    parser.add_argument("--output", help="Write results to this JSON file as well as printing a summary")
+    parser.add_argument("--cycles", type=int, default=5, help="Timed cycles per process_* method (default 5)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every stand-in API response")
+    # Used when running each scraper in its own process
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--hosts", help=argparse.SUPPRESS)
+    parser.add_argument("--influxdb", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        json.dump(run_scraper(args.run, json.loads(args.hosts), args.influxdb, args.cycles), sys.stdout)
+        return
+
+    unknown = set(args.scrapers) - set(SCRAPERS)
+    if unknown:
+        parser.error(f"Unknown scrapers: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(1)
+    influxdb = InfluxDBStandIn()
+    results = {
+        "started_at": datetime.now(tz=timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cycles": args.cycles,
+        "latency_ms": args.latency_ms,
+        "scrapers": {},
+    }
+    for name in args.scrapers or SCRAPERS:
+        stand_ins = STAND_INS[name](rng, args.latency_ms / 1000)
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", name, "--cycles", str(args.cycles),
+             "--hosts", json.dumps({host: stand_in.url for host, stand_in in stand_ins.items()}),
+             "--influxdb", influxdb.url],
+            capture_output=True, text=True)
+        for stand_in in set(stand_ins.values()):
+            stand_in.close()
+        if process.returncode != 0:
+            sys.stderr.write(process.stderr)
+            raise SystemExit(f"{name} benchmark failed")
+        result = results["scrapers"][name] = json.loads(process.stdout)
+        print(f"{name}: startup {result['startup_seconds'] * 1000:.0f} ms, "
+              f"peak RSS {result['peak_rss_bytes'] / 1024 / 1024:.1f} MB")
+        for scenario, stats in result["scenarios"].items():
+            print(f"  {scenario:18} {stats['cycle_seconds']['mean'] * 1000:9.1f} ms/cycle "
+                  f"{stats['points_per_cycle']:7} points {stats['points_per_second']:10.0f} points/s "
+                  f"{stats['alloc_peak_bytes'] / 1024 / 1024:7.1f} MB peak alloc")
+    influxdb.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
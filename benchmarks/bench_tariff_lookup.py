@@ -0,0 +1,73 @@
+"""Compare tariff rate lookup by linear scan against ValidityIndex on an Agile-sized rate table.
+
+    python benchmarks/bench_tariff_lookup.py
+"""
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+
+from common import load_script, timeit
+
+octopus = load_script("octopus-scraper")
+
+RATE_YEARS = 3
+USAGE_DAYS = 4
+
+
+def agile_rates(years):
+    # Agile publishes a rate per half hour, returned newest first
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    rates = []
+    for n in range(years * 365 * 48):
+        valid_from = start + timedelta(minutes=30 * n)
+        rates.append({
+            "value_exc_vat": 10.0 + n % 48,
+            "value_inc_vat": 10.5 + n % 48,
+            "valid_from": valid_from.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "valid_to": (valid_from + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+    rates.reverse()
+    return rates
+
+
+def is_current(now, record):
+    valid_from = dateutil.parser.isoparse(record["valid_from"])
+    valid_to = dateutil.parser.isoparse(record["valid_to"]) if record["valid_to"] else None
+    return valid_from <= now and (valid_to is None or valid_to > now)
+
+
+def linear_lookup(rates, intervals):
+    return [next((rate["value_inc_vat"] for rate in rates if is_current(interval, rate)), None)
+            for interval in intervals]
+
+
+def indexed_lookup(index, intervals):
+    return [index.find(interval)["value_inc_vat"] for interval in intervals]
+
+
+def main():
+    rates = agile_rates(RATE_YEARS)
+    # The most recent few days of usage, as polled by the scraper
+    end = dateutil.parser.isoparse(rates[0]["valid_to"])
+    intervals = [end - timedelta(minutes=30 * n) for n in range(1, USAGE_DAYS * 48 + 1)]
+
+    print(f"{len(rates)} rates, {len(intervals)} half-hour intervals")
+    build = timeit(lambda: octopus.ValidityIndex.from_records(rates), repeat=3)
+    index = octopus.ValidityIndex.from_records(rates)
+    assert indexed_lookup(index, intervals[:10]) == linear_lookup(rates, intervals[:10])
+    lookup = timeit(lambda: indexed_lookup(index, intervals))
+    print(f"ValidityIndex build:  {build * 1000:10.1f} ms (once per tariff)")
+    print(f"ValidityIndex lookup: {lookup * 1000:10.3f} ms")
+    # Recent intervals match near the start of the newest-first list; older ones scan much further
+    linear = timeit(lambda: linear_lookup(rates, intervals), repeat=1)
+    print(f"Linear scan lookup:   {linear * 1000:10.1f} ms")
+    # Too slow to time every interval
+    old_intervals = [interval - timedelta(days=365) for interval in intervals[:10]]
+    linear_old = timeit(lambda: linear_lookup(rates, old_intervals), repeat=1) * len(intervals) / len(old_intervals)
+    print(f"Linear scan lookup, intervals a year old (extrapolated): {linear_old * 1000:10.1f} ms")
+    index_old = timeit(lambda: indexed_lookup(index, [interval - timedelta(days=365) for interval in intervals]))
+    print(f"ValidityIndex lookup, intervals a year old: {index_old * 1000:10.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
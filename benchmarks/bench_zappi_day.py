@@ -0,0 +1,62 @@
+"""Compare parsing and serializing Zappi per-minute day data through dicts and Points against ZappiDayData columns.
+
+    python benchmarks/bench_zappi_day.py
+"""
+import random
+from datetime import date, datetime, timedelta, timezone
+
+from influxdb_client import Point, WritePrecision
+
+from common import load_script, timeit
+from fixtures import zappi_day
+
+zappi = load_script("zappi-scraper")
+
+DAYS = 365
+ZAPPI_SERIAL = 12345678
+
+
+def dict_point_lines(zappi_serial, items):
+    # The per-minute dict and Point path that ZappiDayData replaced
+    result = []
+    for item in items:
+        minute = item.get("min", 0)
+        hour = item.get("hr", 0)
+        day = item.get("dom", 0)
+        month = item.get("mon", 0)
+        year = item.get("yr", 0)
+        timestamp = datetime(year, month, day, hour, minute, 0, tzinfo=timezone.utc)
+        volts = item.get("v1", 0) / 10.0
+        energy = (item.get("h1d", 0) + item.get("h2d", 0) + item.get("h3d", 0) +
+                  item.get("h1b", 0) + item.get("h2b", 0) + item.get("h3b", 0))
+        watts = (energy / volts) * 4
+        result.append({"ts": timestamp, "voltage": volts, "power": watts, "zappi_serial": zappi_serial})
+    points = []
+    for ts_entry in result:
+        point = Point("zappi").tag("zappi_serial", ts_entry["zappi_serial"]).time(ts_entry["ts"], WritePrecision.S)
+        for key in ["voltage", "power"]:
+            point.field(key, ts_entry.get(key, 0.0))
+        points.append(point)
+    return [point.to_line_protocol() for point in points]
+
+
+def columnar_lines(zappi_serial, items):
+    return zappi.ZappiDayData.from_items(zappi_serial, items).to_line_protocol()
+
+
+def main():
+    rng = random.Random(1)
+    days = [zappi_day(date(2023, 1, 1) + timedelta(n), rng) for n in range(DAYS)]
+    for items in days[:10]:
+        assert columnar_lines(ZAPPI_SERIAL, items) == dict_point_lines(ZAPPI_SERIAL, items)
+
+    print(f"{DAYS} days, {DAYS * 24 * 60} readings")
+    baseline = timeit(lambda: [dict_point_lines(ZAPPI_SERIAL, items) for items in days], repeat=1)
+    columnar = timeit(lambda: [columnar_lines(ZAPPI_SERIAL, items) for items in days], repeat=3)
+    parse_only = timeit(lambda: [zappi.ZappiDayData.from_items(ZAPPI_SERIAL, items) for items in days], repeat=3)
+    print(f"Dicts and Points:  {baseline:8.2f} s")
+    print(f"ZappiDayData:      {columnar:8.2f} s ({baseline / columnar:.1f}x), of which parsing {parse_only:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
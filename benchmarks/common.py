@@ -0,0 +1,26 @@
+import importlib.util
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+def load_script(name):
+    """Import one of the hyphen-named scraper scripts, e.g. load_script("octopus-scraper")."""
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(REPO_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timeit(fn, repeat=5):
+    """Best wall-clock time of fn() over repeat runs, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
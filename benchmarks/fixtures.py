@@ -0,0 +1,130 @@
+"""Synthetic API payloads shaped like those returned by Solarman, Octopus, myenergi and the Met Office."""
+import random
+from datetime import date, datetime, timedelta, timezone
+
+SOLARMAN_DAY_KEYS = {
+    'B_left_cap1': '%', 'Pcg_dcg1': 'W', 'Etdy_cg1': 'kWh', 'Etdy_dcg1': 'kWh', 'APo_t1': 'W', 'PG_Pt1': 'W',
+    't_gc_tdy1': 'kWh', 'Etdy_pu1': 'kWh', 'E_Puse_t1': 'W',
+}
+# Solarman returns many more parameters per sample than the scraper keeps
+SOLARMAN_OTHER_KEYS = [f"param{n}" for n in range(60)]
+
+
+def solarman_day(device_sn, day: date, rng: random.Random, samples=288):
+    day_start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+    rows = []
+    for n in range(samples):
+        data_list = [{"key": key, "value": f"{rng.uniform(-5000, 5000):.1f}", "unit": unit, "name": key}
+                     for key, unit in SOLARMAN_DAY_KEYS.items()]
+        data_list += [{"key": key, "value": f"{rng.uniform(0, 100):.2f}", "unit": "V", "name": key}
+                      for key in SOLARMAN_OTHER_KEYS]
+        rows.append({"collectTime": str(day_start + n * 300), "dataList": data_list})
+    return {"code": "0", "success": True, "deviceSn": device_sn, "deviceId": 1, "paramDataList": rows}
+
+
+def solarman_month(device_sn, first_day: date, last_day: date, rng: random.Random):
+    rows = []
+    day = first_day
+    while day <= last_day:
+        rows.append({"collectTime": day.isoformat(),
+                     "dataList": [{"key": key, "value": f"{rng.uniform(0, 50):.1f}", "unit": "kWh"}
+                                  for key in ["generation", "charge", "discharge", "purchase", "grid", "consumption"]]})
+        day += timedelta(1)
+    return {"code": "0", "success": True, "deviceSn": device_sn, "deviceId": 1, "paramDataList": rows}
+
+
+def solarman_snapshot(rng: random.Random, now: datetime):
+    return {"code": "0", "success": True, "lastUpdateTime": now.timestamp(),
+            **{key: rng.uniform(0, 5000) for key in ["generationPower", "batteryPower", "gridPower", "usePower",
+                                                      "chargePower", "dischargePower", "purchasePower"]}}
+
+
+def zappi_day(day: date, rng: random.Random):
+    items = []
+    for minute in range(24 * 60):
+        item = {"yr": day.year, "mon": day.month, "dom": day.day, "v1": rng.randint(2300, 2500)}
+        # Like the API, zero values are left out
+        if minute % 60:
+            item["min"] = minute % 60
+        if minute // 60:
+            item["hr"] = minute // 60
+        if rng.random() < 0.3:
+            item["h1d"] = rng.randint(1, 400000)
+            if rng.random() < 0.2:
+                item["h1b"] = rng.randint(1, 400000)
+        items.append(item)
+    return items
+
+
+def zappi_status(zappi_serial, now: datetime, rng: random.Random):
+    return {"zappi": [{"sno": zappi_serial, "dat": now.strftime("%d-%m-%Y"), "tim": now.strftime("%H:%M:%S"),
+                       "div": rng.randint(0, 7000), "vol": rng.randint(2300, 2500)}]}
+
+
+def agile_rates(start: datetime, end: datetime):
+    """A rate per half hour from start to end, newest first as the API returns them."""
+    rates = []
+    valid_from = start
+    n = 0
+    while valid_from < end:
+        rates.append({
+            "value_exc_vat": 10.0 + n % 48,
+            "value_inc_vat": 10.5 + n % 48,
+            "valid_from": valid_from.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "valid_to": (valid_from + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "payment_method": None,
+        })
+        valid_from += timedelta(minutes=30)
+        n += 1
+    rates.reverse()
+    return rates
+
+
+def octopus_consumption(start: datetime, end: datetime, rng: random.Random):
+    """Half-hourly consumption from start to end, newest first."""
+    results = []
+    interval_start = start
+    while interval_start < end:
+        interval_end = interval_start + timedelta(minutes=30)
+        results.append({"consumption": round(rng.uniform(0, 2), 3),
+                        "interval_start": interval_start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        "interval_end": interval_end.strftime("%Y-%m-%dT%H:%M:%SZ")})
+        interval_start = interval_end
+    results.reverse()
+    return results
+
+
+def octopus_account(account, tariff_code, gas_tariff_code):
+    agreements = [{"tariff_code": tariff_code, "valid_from": "2020-01-01T00:00:00Z", "valid_to": None}]
+    return {
+        "number": account,
+        "properties": [{
+            "electricity_meter_points": [
+                {"mpan": "1000000000001", "is_export": False, "meters": [{"serial_number": "E1"}],
+                 "agreements": agreements},
+                {"mpan": "1000000000002", "is_export": True, "meters": [{"serial_number": "E1"}],
+                 "agreements": agreements},
+            ],
+            "gas_meter_points": [
+                {"mprn": "2000000001", "meters": [{"serial_number": "G1"}],
+                 "agreements": [{"tariff_code": gas_tariff_code, "valid_from": "2020-01-01T00:00:00Z",
+                                 "valid_to": None}]},
+            ],
+        }],
+    }
+
+
+def met_office_forecast(fields, model_run: datetime, steps, step: timedelta, rng: random.Random):
+    start = model_run.replace(minute=0)
+    time_series = []
+    for n in range(steps):
+        entry = {"time": (start + step * n).strftime("%Y-%m-%dT%H:%MZ")}
+        for key, field_type in fields.items():
+            entry[key] = field_type(rng.uniform(0, 100))
+        time_series.append(entry)
+    return {"type": "FeatureCollection", "features": [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [0.0, 51.1, 10.0]},
+        "properties": {"location": {"name": "London"}, "requestPointDistance": 100.0,
+                       "modelRunDate": model_run.strftime("%Y-%m-%dT%H:%MZ"), "timeSeries": time_series},
+    }]}
@@ -0,0 +1,104 @@
+"""Local HTTP servers standing in for the scrapers' APIs and for InfluxDB, so cycles can be benchmarked offline."""
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import requests.adapters
+
+
+class StandIn:
+    """A local server answering requests with handle(method, path, query, body) -> (status, headers, body)."""
+
+    def __init__(self, handle, latency=0.0):
+        self.handle = handle
+        self.latency = latency
+        self.requests = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Otherwise the body, written after the headers, waits on the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.respond()
+
+            def respond(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                stand_in.requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                status, headers, payload = stand_in.handle(self.command, url.path, parse_qs(url.query), body)
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload).encode()
+                    headers = {"Content-Type": "application/json"} | headers
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class InfluxDBStandIn(StandIn):
+    """Accepts /api/v2/write and counts the lines written."""
+
+    def __init__(self, latency=0.0):
+        self.lines = 0
+        self.lock = threading.Lock()
+        super().__init__(self.write, latency)
+
+    def write(self, method, path, query, body):
+        if path != "/api/v2/write":
+            return 404, {}, b""
+        lines = body.count(b"\n") + 1 if body else 0
+        with self.lock:
+            self.lines += lines
+        return 204, {}, b""
+
+
+def route_hosts(hosts):
+    """Send requests made through requests to https://{host} to the stand-in URL given for that host instead."""
+    send = requests.adapters.HTTPAdapter.send
+
+    def routed_send(adapter, request, **kwargs):
+        url = urlsplit(request.url)
+        if url.hostname in hosts:
+            local = urlsplit(hosts[url.hostname])
+            request.url = urlunsplit((local.scheme, local.netloc, url.path, url.query, url.fragment))
+        return send(adapter, request, **kwargs)
+
+    requests.adapters.HTTPAdapter.send = routed_send
+
+
+def paged(results, query, base_url, path, default_page_size=100):
+    """One page of results in the Octopus API's paginated form."""
+    page_size = int(query.get("page_size", [default_page_size])[0])
+    page = int(query.get("page", ["1"])[0])
+    start = (page - 1) * page_size
+    next_url = None
+    if start + page_size < len(results):
+        next_url = f"{base_url}{path}?page_size={page_size}&page={page + 1}"
+    return {"count": len(results), "next": next_url, "previous": None,
+            "results": results[start:start + page_size]}
@@ -0,0 +1,120 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+
+class CheckpointStore:
+    """Records which days, and up to which timestamp, have been ingested per source and device,
+    so restarts only backfill the gap. Also keeps rollup totals that later fetches add to."""
+
+    logger = logging.getLogger('CheckpointStore')
+
+    def __init__(self, checkpoint_config=None):
+        checkpoint_config = checkpoint_config or {}
+        self.path = checkpoint_config.get("path", ".scraper-checkpoints.db")
+        self.max_gap_days = checkpoint_config.get("max_gap_days")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    source TEXT NOT NULL,
+                    device TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    complete INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (source, device, day)
+                )""")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    source TEXT NOT NULL,
+                    device TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (source, device)
+                )""")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS rollups (
+                    source TEXT NOT NULL,
+                    device TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    totals TEXT NOT NULL,
+                    PRIMARY KEY (source, device, start)
+                )""")
+
+    def mark_day(self, source, device, day: date, complete):
+        with self.lock, self.db:
+            # Never downgrade a complete day, e.g. when a later poll of the same day returns less data
+            self.db.execute("""
+                INSERT INTO checkpoints (source, device, day, complete, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (source, device, day) DO UPDATE
+                SET complete = MAX(complete, excluded.complete), updated_at = excluded.updated_at""",
+                (source, str(device), day.isoformat(), int(complete), time.time()))
+
+    def complete_days(self, source, device, start: date, end: date):
+        """The days from start to end inclusive that are marked complete."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT day FROM checkpoints WHERE source = ? AND device = ? AND day BETWEEN ? AND ? AND complete = 1",
+                (source, str(device), start.isoformat(), end.isoformat())).fetchall()
+        return {date.fromisoformat(row[0]) for row in rows}
+
+    def advance_watermark(self, source, device, value):
+        """Record the newest timestamp (epoch seconds) ingested for a device; older values are ignored."""
+        with self.lock, self.db:
+            self.db.execute("""
+                INSERT INTO watermarks (source, device, value, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (source, device) DO UPDATE
+                SET value = MAX(value, excluded.value), updated_at = excluded.updated_at""",
+                (source, str(device), value, time.time()))
+
+    def watermark(self, source, device):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM watermarks WHERE source = ? AND device = ?", (source, str(device))).fetchone()
+        return row[0] if row else None
+
+    def save_rollups(self, source, device, totals_by_start, retention):
+        """Replace the saved totals ({field: total}) of the buckets starting at the given epoch seconds, and drop
+        those starting more than retention seconds before the newest."""
+        if not totals_by_start:
+            return
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO rollups (source, device, start, totals) VALUES (?, ?, ?, ?)",
+                [(source, str(device), start, json.dumps(totals)) for start, totals in totals_by_start.items()])
+            self.db.execute("DELETE FROM rollups WHERE source = ? AND device = ? AND start < ?",
+                            (source, str(device), max(totals_by_start) - retention))
+
+    def rollups(self, source, device, start, end):
+        """Saved totals of the buckets starting from start up to but not including end, by bucket start."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT start, totals FROM rollups WHERE source = ? AND device = ? AND start >= ? AND start < ?",
+                (source, str(device), start, end)).fetchall()
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def last_complete_day(self, source, device):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT MAX(day) FROM checkpoints WHERE source = ? AND device = ? AND complete = 1",
+                (source, str(device))).fetchone()
+        return date.fromisoformat(row[0]) if row[0] else None
+
+    def backfill_days(self, source, device, today: date, default_days):
+        """Days before today that need ingesting: everything after the last complete day, or default_days
+        when there is no checkpoint yet, capped at max_gap_days."""
+        last_complete = self.last_complete_day(source, device)
+        start = today - timedelta(default_days) if last_complete is None else last_complete + timedelta(1)
+        if self.max_gap_days is not None and start < today - timedelta(self.max_gap_days):
+            self.logger.warning(f"Gap for {source} {device} since {start} exceeds {self.max_gap_days} days, "
+                                f"only backfilling the most recent days")
+            start = today - timedelta(self.max_gap_days)
+        return [start + timedelta(n) for n in range((today - start).days)]
@@ -0,0 +1,315 @@
+import atexit
+import logging
+import queue
+import re
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import retry
+from cachetools import TTLCache
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
+
+import metrics
+from write_spool import WriteSpool
+
+# Markers placed on the queue alongside (bucket, precision, line, change filter entry) items
+_FLUSH = object()
+_STOP = object()
+
+# Separates measurement and tags from fields, and fields from the timestamp, in line protocol
+_UNESCAPED_SPACE = re.compile(r"(?<!\\) ")
+_TIMESTAMP = re.compile(r"-?[0-9]+")
+
+WRITE_SECONDS = metrics.REGISTRY.histogram(
+    "scraper_influxdb_write_seconds", "Duration of each batch written to InfluxDB, including retries", ("bucket",))
+
+# stats() keys exposed as metrics, with their Prometheus type
+_STATS_METRICS = {
+    "queue_depth": ("gauge", "Points waiting to be written"),
+    "points_written": ("counter", "Points written to InfluxDB"),
+    "points_failed": ("counter", "Points rejected by InfluxDB"),
+    "points_spooled": ("counter", "Points spooled to disk while InfluxDB was unavailable"),
+    "points_replayed": ("counter", "Spooled points written once InfluxDB was available again"),
+    "points_evicted": ("counter", "Spooled points discarded because the spool was full"),
+    "points_suppressed": ("counter", "Points not written because they were unchanged since the last write"),
+}
+
+
+class ChangeFilter:
+    """Remembers a hash of the fields last written for each series and timestamp, to skip rewriting unchanged points."""
+
+    def __init__(self, maxsize, ttl):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.suppressed = 0
+
+    def lookup(self, bucket, line):
+        """Whether the line's fields are the same as when it was last written, and the entry to record() once it
+        has been written this time. Lines without a timestamp are never unchanged, and have no entry."""
+        series, fields = _UNESCAPED_SPACE.split(line, 1)
+        fields, separator, timestamp = fields.rpartition(" ")
+        # A string field value may hold spaces, but can't end the line without a closing quote
+        if not separator or not _TIMESTAMP.fullmatch(timestamp):
+            return False, None
+        key = (bucket, series, timestamp)
+        fields_hash = hash(fields)
+        with self.lock:
+            previous_hash = self.cache.get(key)
+            if previous_hash is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if previous_hash == fields_hash:
+                    self.suppressed += 1
+                    return True, None
+        return False, (key, fields_hash)
+
+    def record(self, entries):
+        """Remember points InfluxDB has accepted, so that rewrites of points it rejected or never got go through."""
+        with self.lock:
+            for key, fields_hash in entries:
+                self.cache[key] = fields_hash
+
+
+class WritePipeline:
+    """Writes points to InfluxDB from a background thread so that scraping never waits on the database."""
+
+    logger = logging.getLogger('WritePipeline')
+
+    def __init__(self, influxdb_config):
+        self.influxdb_config = dict(influxdb_config)
+        # Settings not understood by InfluxDBClient
+        self.batch_size = self.influxdb_config.pop("batch_size", 1000)
+        self.flush_interval = self.influxdb_config.pop("flush_interval", 5)
+        self.queue_size = self.influxdb_config.pop("queue_size", 100000)
+        spool_path = self.influxdb_config.pop("spool_path", ".write-spool")
+        spool_max_mb = self.influxdb_config.pop("spool_max_mb", 100)
+        self.drain_interval = self.influxdb_config.pop("drain_interval", 30)
+        self.drain_batch_size = self.influxdb_config.pop("drain_batch_size", 10000)
+        change_cache_size = self.influxdb_config.pop("change_cache_size", 100000)
+        change_cache_ttl = self.influxdb_config.pop("change_cache_ttl", 6 * 60 * 60)
+        self.influxdb_config.setdefault("enable_gzip", True)
+        self.client = InfluxDBClient(**self.influxdb_config)
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.points_written = 0
+        self.points_failed = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+        # Scrapers rewrite overlapping data every poll; points identical to the last write are dropped
+        self.change_filter = ChangeFilter(change_cache_size, change_cache_ttl) if change_cache_size else None
+
+        # Points that can't be written go to the spool until the drainer finds InfluxDB available again
+        self.spool = WriteSpool(spool_path, max_bytes=spool_max_mb * 1024 * 1024)
+        self.sink_available = True
+
+        self.closed = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="WritePipeline", daemon=True)
+        self.thread.start()
+        self.drain_thread = threading.Thread(target=self._drain, name="WritePipelineDrain", daemon=True)
+        self.drain_thread.start()
+        atexit.register(self.close)
+        metrics.REGISTRY.collector(self._collect_metrics)
+        if threading.current_thread() is threading.main_thread():
+            # Default SIGTERM handling exits without running atexit hooks, losing queued points
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    def write(self, bucket, points):
+        for point in points:
+            self._enqueue(bucket, point.write_precision, point.to_line_protocol())
+
+    def write_lines(self, bucket, precision, lines):
+        """Write points already serialized to line protocol, all with the same precision."""
+        for line in lines:
+            self._enqueue(bucket, precision, line)
+
+    def _enqueue(self, bucket, precision, line):
+        # Points without fields serialize to nothing, and can't be written
+        if not line:
+            return
+        change = None
+        if self.change_filter:
+            unchanged, change = self.change_filter.lookup(bucket, line)
+            if unchanged:
+                return
+        item = (bucket, precision, line, change)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Backpressure: block the scraper until the writer thread catches up
+            self.logger.warning(f"Write queue full ({self.queue_size} points), waiting for InfluxDB")
+            self.queue.put(item)
+
+    def flush(self):
+        """Block until every point queued so far has been written (or given up on)."""
+        self.queue.put(_FLUSH)
+        self.queue.join()
+
+    def points_undelivered(self):
+        """Points spooled, rejected or discarded so far, for callers to check that a flush() wrote everything."""
+        return self.points_failed + self.spool.points_spooled
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.stopped.set()
+        self.drain_thread.join()
+        self.client.close()
+        self.logger.info(f"Write pipeline closed: {self.stats()}")
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "points_written": self.points_written,
+            "points_failed": self.points_failed,
+            "flushes": self.flushes,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "total_flush_latency": self.total_flush_latency,
+            "points_spooled": self.spool.points_spooled,
+            "points_replayed": self.spool.points_replayed,
+            "points_evicted": self.spool.points_evicted,
+            "change_cache_hits": self.change_filter.hits if self.change_filter else 0,
+            "change_cache_misses": self.change_filter.misses if self.change_filter else 0,
+            "points_suppressed": self.change_filter.suppressed if self.change_filter else 0,
+        }
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        return [(f"scraper_pipeline_{key}" + ("_total" if metric_type == "counter" else ""), metric_type, help,
+                 [({}, stats[key])])
+                for key, (metric_type, help) in _STATS_METRICS.items()]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            marker = None
+            deadline = None
+            # Collect until the batch is full, the oldest point reaches flush_interval, or a marker arrives
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _FLUSH or item is _STOP:
+                    marker = item
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception:
+                    # Losing a batch is better than losing the thread, which flush() and full queues wait on
+                    self.logger.exception(f"Failed to write or spool {len(batch)} points, discarding them")
+                    self.points_failed += len(batch)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+            if marker is not None:
+                self.queue.task_done()
+                stopping = marker is _STOP
+
+    def _flush(self, batch):
+        items_by_destination = defaultdict(list)
+        for bucket, precision, line, change in batch:
+            items_by_destination[(bucket, precision)].append((line, change))
+        for (bucket, precision), items in items_by_destination.items():
+            lines = [line for line, _ in items]
+            if not self.sink_available:
+                self._spool(bucket, precision, lines)
+                continue
+            start = time.monotonic()
+            try:
+                self._write_chunk(bucket, precision, lines)
+            except Exception as e:
+                if is_rejected(e):
+                    self.logger.exception(f"InfluxDB rejected {len(lines)} points for {bucket}")
+                    self.points_failed += len(lines)
+                else:
+                    self.logger.warning(f"InfluxDB unavailable ({e}), spooling points until it recovers")
+                    self.sink_available = False
+                    self._spool(bucket, precision, lines)
+                continue
+            latency = time.monotonic() - start
+            if self.change_filter:
+                self.change_filter.record(change for _, change in items if change is not None)
+            WRITE_SECONDS.observe(latency, bucket)
+            self.points_written += len(lines)
+            self.flushes += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+    def _spool(self, bucket, precision, lines):
+        try:
+            self.spool.append(bucket, precision, lines)
+        except OSError:
+            # e.g. the disk is full; the points are lost but the writer carries on
+            self.logger.exception(f"Failed to spool {len(lines)} points for {bucket}, discarding them")
+            self.points_failed += len(lines)
+
+    @retry.retry(tries=3, delay=1, backoff=2, logger=logger)
+    def _write_chunk(self, bucket, precision, lines):
+        self.write_api.write(bucket, self.client.org, "\n".join(lines), write_precision=precision)
+
+    def _drain(self):
+        while not self.stopped.wait(self.drain_interval):
+            try:
+                self._drain_spool()
+            except Exception:
+                # The thread must survive, or spooled points would never be replayed
+                self.logger.exception("Failed to drain the spool")
+
+    def _drain_spool(self):
+        if not self.spool.pending():
+            # Nothing to replay, e.g. the points that found InfluxDB unavailable couldn't be spooled either
+            if not self.sink_available and self.client.ping():
+                self.logger.info("InfluxDB available again")
+                self.sink_available = True
+            return
+        try:
+            self.spool.drain(self._replay, self.drain_batch_size)
+            if not self.sink_available:
+                self.logger.info("InfluxDB available again, spool drained")
+            self.sink_available = True
+        except Exception as e:
+            self.sink_available = False
+            self.logger.info(f"InfluxDB still unavailable ({e}), {self.spool.size()} bytes spooled")
+
+    def _replay(self, bucket, precision, lines):
+        try:
+            self.write_api.write(bucket, self.client.org, "\n".join(lines), write_precision=precision)
+            self.points_written += len(lines)
+        except Exception as e:
+            if not is_rejected(e):
+                raise
+            # Retrying data InfluxDB refuses would block the spool forever
+            self.logger.error(f"InfluxDB rejected {len(lines)} spooled points for {bucket}, discarding: {e}")
+            self.points_failed += len(lines)
+
+
+def is_rejected(e):
+    """Whether InfluxDB refused the data itself, rather than being unreachable or overloaded."""
+    return isinstance(e, ApiException) and e.status is not None and 400 <= e.status < 500 and e.status != 429
@@ -2,12 +2,32 @@
 
 cmd="$*"
 
+# Scrapers run under supervisor.py back off from their own failures (Kia still waiting 30 minutes), so this
+# only restarts the process itself: after 10s, doubling while it keeps failing quickly, up to 30 minutes
+initial_delay=10
+max_delay=1800
+delay=$initial_delay
+
+# Every restart of a process running the Kia scraper logs into Kia again, which wakes the car and drains its 12V
+# battery, so those restarts wait at least 30 minutes. supervisor.py without scraper names runs them all
+min_delay=0
+if [[ "$cmd" == *kia-scraper* || "$cmd" =~ supervisor\.py[[:space:]]*$ ]]; then
+  min_delay=1800
+fi
+
 echo "$(date -Is) Running $cmd"
 
-until eval "$cmd"; do
+while true; do
+  started=$SECONDS
+  eval "$cmd" && break
   echo "$(date -Is) Command failed with exit code $?"
-  # Long sleep to prevent draining KIA battery
-  sleep 1800
+  # A run that lasted an hour or more starts the backoff again
+  if (( SECONDS - started >= 3600 )); then
+    delay=$initial_delay
+  fi
+  pause=$(( delay > min_delay ? delay : min_delay ))
+  # Up to 20% jitter
+  sleep $(( pause + RANDOM % (pause / 5 + 1) ))
+  delay=$(( delay * 2 > max_delay ? max_delay : delay * 2 ))
   echo "$(date -Is) Restarting $cmd"
 done
-
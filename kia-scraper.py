@@ -5,8 +5,11 @@ import retry
 import hyundai_kia_connect_api as kia
 import yaml
 import requests
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client import Point, WritePrecision
+
+from influxdb_writer import WritePipeline
+import metrics
+import profiling
 
 FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
@@ -14,12 +17,14 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 # Monkeypatch requests library to add a timeout
 base_requests_post = requests.post
 def requests_post(url, **kwargs):
-  return base_requests_post(url, **kwargs, timeout=30)
+  kwargs.setdefault("timeout", 30)
+  return base_requests_post(url, **kwargs)
 requests.post = requests_post
 
 base_requests_get = requests.get
 def requests_get(url, **kwargs):
-  return base_requests_get(url, **kwargs, timeout=30)
+  kwargs.setdefault("timeout", 30)
+  return base_requests_get(url, **kwargs)
 requests.get = requests_get
 
 
@@ -35,6 +40,7 @@ class KiaConnectClient:
         self.logger.info("Logged in successfully")
 
     @retry.retry(tries=2, delay=10, backoff=1, logger=logger)
+    @metrics.timed
     def get_snapshot(self):
         self.vehicle_manager.check_and_refresh_token()
         self.vehicle_manager.check_and_force_update_vehicles(60 * 60)
@@ -47,12 +53,9 @@ class InfluxDBWriter:
 
     logger = logging.getLogger('InfluxDBWriter')
 
-    def __init__(self, influxdb_config):
-        self.influxdb_config = influxdb_config
-        self.client = InfluxDBClient(**influxdb_config)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+    def __init__(self, pipeline: WritePipeline):
+        self.pipeline = pipeline
 
-    @retry.retry(tries=10, delay=1, logger=logger)
     def write_snapshot(self, snapshot):
         for car in snapshot.values():
 
@@ -71,21 +74,31 @@ class InfluxDBWriter:
                 point.field("12v_battery_percentage", int(car.data["vehicleStatus"]["battery"].get("batSoc", -1)))
                 point.field("12v_battery_state", int(car.data["vehicleStatus"]["battery"].get("batState", -1)))
 
-            self.write_api.write("kia_connect", self.client.org, point)
+            self.pipeline.write("kia_connect", [point])
 
 
 class KiaScraper:
 
     logger = logging.getLogger('KiaScraper')
 
-    def __init__(self, config):
+    # Seconds between polls (KIA throttles maximum number of checks per day)
+    interval = 12 * 60 * 60
+
+    def __init__(self, config, pipeline: WritePipeline = None):
         self.config = config
 
         kia_config = config["kia"]
         self.kia_connect = KiaConnectClient(kia_config)
 
         influxdb_config = config["influxdb"]
-        self.influxdb = InfluxDBWriter(influxdb_config)
+        self.influxdb = InfluxDBWriter(pipeline or WritePipeline(influxdb_config))
+
+    def start(self):
+        # Only the current state is available, there is no history to backfill
+        pass
+
+    def poll(self):
+        self.process_snapshot()
 
     def process_snapshot(self):
         self.logger.info(f"Processing snapshot")
@@ -107,11 +120,12 @@ def main():
     with open(".solarman-scraper.yml", "r") as yamlfile:
         config = yaml.load(yamlfile, Loader=yaml.FullLoader)
     scraper = KiaScraper(config)
+    profiling.instrument(scraper, config.get("profiling"))
+    scraper.start()
 
     while True:
-        # Get current value (KIA throttles maximum number of checks per day)
-        scraper.process_snapshot()
-        sleep(12 * 60 * 60)
+        scraper.poll()
+        sleep(scraper.interval)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('Metrics')
+
+# Seconds; API calls time out after 60s and some cycles (backfills, Octopus history) take minutes
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [count per bucket..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, counts in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = format_labels(self.labels + ("le",), label_values + (str(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = format_labels(self.labels + ("le",), label_values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {counts[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text format. Collectors are called at render time and return
+    (name, type, help, [(labels dict, value)]) for values kept elsewhere, e.g. the write pipeline's counters."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collect in self.collectors:
+            for name, metric_type, help, samples in collect():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {metric_type}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+REGISTRY = Registry()
+
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "scraper_api_request_seconds", "Duration of each attempt at an API client method", ("method",))
+API_FAILURES = REGISTRY.counter(
+    "scraper_api_failures_total",
+    "Failed attempts at an API client method, including final attempts and errors that aren't retried", ("method",))
+
+
+def timed(fn):
+    """Records the latency and failures of each attempt at an API call, under its qualified name.
+    Apply beneath @retry.retry so that every attempt is counted, not just the last."""
+    method = fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            API_FAILURES.inc(method)
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(time.monotonic() - start, method)
+
+    return wrapper
+
+
+def serve(metrics_config):
+    """Serve REGISTRY at /metrics on metrics_config's address and port, from a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    address = metrics_config.get("address", "127.0.0.1")
+    server = ThreadingHTTPServer((address, metrics_config["port"]), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+    logger.info(f"Serving metrics at http://{address}:{server.server_port}/metrics")
+    return server
@@ -1,4 +1,10 @@
+import argparse
+import json
+import math
+import os
 import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 from datetime import datetime, timedelta, date, timezone
@@ -7,19 +13,127 @@ import dateutil.parser
 import logging
 import retry
 import requests
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client import Point, WritePrecision
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+from checkpoints import CheckpointStore
+from influxdb_writer import WritePipeline
+from rollups import DAY, HOUR, EnergyRollup, rollup_serializers
+import metrics
+import profiling
+
+# Days loaded on a first run, before any checkpoints exist
 BACKFILL_DAYS=4
 
+# Intervals before the last one written that are fetched again, in case readings are revised
+SETTLEMENT_OVERLAP_HOURS=2
+
+# Hourly and daily totals of energy in kWh (m3 for some gas meters) and cost in pounds, written to octopus_hourly
+# and octopus_daily over UTC hours and days
+ROLLUP_LINES = rollup_serializers("octopus", ["account", "mpan", "meter", "is_export", "is_gas"], ["energy", "cost"])
+
+# Hourly totals are kept in the checkpoint store for this long, to add later fetches of the same day to
+ROLLUP_RETENTION = 35 * 24 * 60 * 60
+
 FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
-def is_current(now, record):
-    valid_from = dateutil.parser.isoparse(record["valid_from"])
-    valid_to = dateutil.parser.isoparse(record["valid_to"]) if record["valid_to"] else None
-    return valid_from <= now and (valid_to is None or valid_to > now)
+def parse_timestamp(value: str):
+    try:
+        # Much faster than dateutil for the API's usual "2023-01-01T00:00:00Z" form
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return dateutil.parser.isoparse(value)
+
+
+def validity_window(record):
+    """(start epoch, end epoch or None, record) for a record with valid_from/valid_to."""
+    return (parse_timestamp(record["valid_from"]).timestamp(),
+            parse_timestamp(record["valid_to"]).timestamp() if record["valid_to"] else None,
+            record)
+
+
+class ValidityIndex:
+    """Records with valid_from/valid_to windows (tariff rates, agreements), parsed once for bisect lookup."""
+
+    def __init__(self, windows):
+        # Reversed so that, of windows with the same start, the first given is the one found
+        windows = sorted(reversed(list(windows)), key=lambda window: window[0])
+        self.starts = [start for start, _, _ in windows]
+        self.ends = [math.inf if end is None else end for _, end, _ in windows]
+        self.records = [record for _, _, record in windows]
+        # Latest end of any window starting at or before each position, to stop searching early
+        self.max_ends = []
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+    @classmethod
+    def from_records(cls, records):
+        return cls(validity_window(record) for record in records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, now: datetime):
+        """The current record with the latest valid_from, or None."""
+        ts = now.timestamp()
+        i = bisect_right(self.starts, ts) - 1
+        # Windows rarely overlap, so this nearly always stops at the first candidate
+        while i >= 0 and self.max_ends[i] > ts:
+            if self.ends[i] > ts:
+                return self.records[i]
+            i -= 1
+        return None
+
+
+class RateCache:
+    """Tariff rate windows kept on disk between runs and refreshed incrementally."""
+
+    logger = logging.getLogger('RateCache')
+
+    def __init__(self, path, fetch_rates):
+        self.path = path
+        self.fetch_rates = fetch_rates  # (tariff_code, period_from) -> rate records
+        self.windows = {}  # tariff code -> [(start epoch, end epoch or None, rate)]
+        self.indexes = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.windows = {tariff_code: [tuple(window) for window in windows]
+                                for tariff_code, windows in json.load(f).items()}
+            self.logger.info(f"Loaded rates for {len(self.windows)} tariffs from {self.path}")
+
+    def get(self, tariff_code):
+        if tariff_code not in self.indexes:
+            if tariff_code in self.windows:
+                self.indexes[tariff_code] = ValidityIndex(self.windows[tariff_code])
+            else:
+                self.refresh(tariff_code)
+                self.save()
+        return self.indexes[tariff_code]
+
+    def refresh(self, tariff_code):
+        cached = self.windows.get(tariff_code, [])
+        # Rows from the newest cached valid_from onwards replace the cached ones, e.g. when a valid_to gets set
+        period_from = datetime.fromtimestamp(max(start for start, _, _ in cached), tz=timezone.utc) if cached else None
+        fetched = [(start, end, {key: rate.get(key) for key in ["value_exc_vat", "value_inc_vat", "payment_method"]})
+                   for start, end, rate in map(validity_window, self.fetch_rates(tariff_code, period_from))]
+        merged = {(start, rate["payment_method"]): (start, end, rate) for start, end, rate in cached + fetched}
+        self.windows[tariff_code] = sorted(merged.values(), key=lambda window: window[0], reverse=True)
+        self.indexes[tariff_code] = ValidityIndex(self.windows[tariff_code])
+        self.logger.info(f"Fetched {len(fetched)} rates for {tariff_code} from {period_from or 'the beginning'}")
+
+    def retain(self, tariff_codes):
+        for tariff_code in set(self.windows) - set(tariff_codes):
+            self.logger.info(f"Evicting rates for {tariff_code}, no longer in any agreement")
+            del self.windows[tariff_code]
+            self.indexes.pop(tariff_code, None)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.windows, f)
+        os.replace(tmp_path, self.path)
 
 
 class OctopusClient:
@@ -30,55 +144,80 @@ class OctopusClient:
         self.url = "https://api.octopus.energy/v1"
         self.auth = HTTPBasicAuth(f"{config['key']}", "")
         self.account = config["account"]
+        self.page_size = config.get("page_size", 1500)
+        max_workers = config.get("max_workers", 4)
+        self.session = requests.session()
+        self.session.auth = self.auth
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="OctopusClient")
 
     @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @metrics.timed
     def get_account(self):
-        response = requests.get(f"{self.url}/accounts/{self.account}/", auth=self.auth)
+        response = self.session.get(f"{self.url}/accounts/{self.account}/", timeout=60)
         response.raise_for_status()
         account = response.json()
         return account
 
+    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @metrics.timed
+    def get_page(self, url, params=None):
+        response = self.session.get(url, params=params, timeout=300)
+        response.raise_for_status()
+        return response.json()
+
     def get_results(self, url):
-        results = []
-        while url:
-            response = requests.get(url, auth=self.auth, timeout=300)
-            data = response.json()
-            if "results" in data:
-                results.extend(data["results"])
+        """Generates the results of every page, fetching pages after the first concurrently when the count is known."""
+        data = self.get_page(url, {"page_size": self.page_size})
+        yield from data.get("results", [])
+        count = data.get("count")
+        if data.get("next") and count is not None:
+            page_size = len(data.get("results", [])) or self.page_size
+            pages = range(2, math.ceil(count / page_size) + 1)
+            # map() yields pages in order as they complete, so results still stream in API order
+            for page in self.executor.map(lambda page: self.get_page(url, {"page_size": page_size, "page": page}), pages):
+                yield from page.get("results", [])
+        else:
             url = data.get("next")
-        return results
+            while url:
+                data = self.get_page(url)
+                yield from data.get("results", [])
+                url = data.get("next")
 
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
-    def get_electricity_tariff_rates(self, tariff: str):
+    def get_electricity_tariff_rates(self, tariff: str, period_from: datetime = None):
         product = self.product_for_tariff(tariff)
         return self.get_results(
-            f"{self.url}/products/{product}/electricity-tariffs/{tariff}/standard-unit-rates/")
+            f"{self.url}/products/{product}/electricity-tariffs/{tariff}/standard-unit-rates/{self.period_query(period_from)}")
 
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
-    def get_gas_tariff_rates(self, tariff: str):
+    def get_gas_tariff_rates(self, tariff: str, period_from: datetime = None):
         product = self.product_for_tariff(tariff)
         return self.get_results(
-            f"{self.url}/products/{product}/gas-tariffs/{tariff}/standard-unit-rates/")
+            f"{self.url}/products/{product}/gas-tariffs/{tariff}/standard-unit-rates/{self.period_query(period_from)}")
+
+    def get_tariff_rates(self, tariff: str, period_from: datetime = None):
+        if tariff.startswith("G-"):
+            return self.get_gas_tariff_rates(tariff, period_from)
+        return self.get_electricity_tariff_rates(tariff, period_from)
 
     def product_for_tariff(self, tariff: str):
         parts = tariff.split("-")
         return "-".join(parts[2:-1])
 
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
-    def get_electricity_usage(self, mpan, serial_number):
-        return self.get_results(f"{self.url}/electricity-meter-points/{mpan}/meters/{serial_number}/consumption/?period_from={self.period_from()}")
+    def get_electricity_usage(self, mpan, serial_number, period_from: datetime):
+        return self.get_results(f"{self.url}/electricity-meter-points/{mpan}/meters/{serial_number}/consumption/?period_from={self.format_period(period_from)}")
 
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
-    def get_gas_usage(self, mprn, serial_number):
-        result = self.get_results(f"{self.url}/gas-meter-points/{mprn}/meters/{serial_number}/consumption/?period_from={self.period_from()}")
+    def get_gas_usage(self, mprn, serial_number, period_from: datetime):
+        result = self.get_results(f"{self.url}/gas-meter-points/{mprn}/meters/{serial_number}/consumption/?period_from={self.format_period(period_from)}")
         # Convert m^3 to kWh with 1.02264
         for usage in result:
             usage["consumption"] *= (1.02264 * 39.0 / 3.6)
-        return result
+            yield usage
+
+    def format_period(self, period_from: datetime):
+      return period_from.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M")
 
-    def period_from(self, days_ago=BACKFILL_DAYS):
-      period_from = datetime.now(tz=timezone.utc) - timedelta(days_ago)
-      return period_from.strftime("%Y-%m-%d %H:%M")
+    def period_query(self, period_from: datetime):
+      return f"?period_from={self.format_period(period_from)}" if period_from else ""
      
      
 
@@ -86,12 +225,9 @@ class InfluxDBWriter:
 
     logger = logging.getLogger('InfluxDBWriter')
 
-    def __init__(self, influxdb_config):
-        self.influxdb_config = influxdb_config
-        self.client = InfluxDBClient(**influxdb_config)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+    def __init__(self, pipeline: WritePipeline):
+        self.pipeline = pipeline
 
-    @retry.retry(tries=10, delay=1, logger=logger)
     def write_snapshot(self,
                        account,
                        mpan,
@@ -118,49 +254,95 @@ class InfluxDBWriter:
             point.field("rate", rate_pence)
         if cost is not None:
             point.field("cost", cost)
-        self.write_api.write("octopus", self.client.org, point)
+        self.pipeline.write("octopus", [point])
+
+    def write_rollup(self, rollup: EnergyRollup):
+        self.pipeline.write_lines("octopus", WritePrecision.S, rollup.lines())
 
 
 class OctopusScraper:
 
     logger = logging.getLogger('OctopusScraper')
 
-    def __init__(self, config):
+    # Seconds between polls; no need to poll more than once every 4 hours, data updates daily
+    interval = 4*60*60
+
+    def __init__(self, config, pipeline: WritePipeline = None):
         self.config = config
 
         octopus_config = config["octopus"]
         self.octopus = OctopusClient(octopus_config)
 
         influxdb_config = config["influxdb"]
-        self.influxdb = InfluxDBWriter(influxdb_config)
+        self.influxdb = InfluxDBWriter(pipeline or WritePipeline(influxdb_config))
+
+        self.checkpoints = CheckpointStore(config.get("checkpoints"))
+        self.settlement_overlap = timedelta(hours=octopus_config.get("settlement_overlap_hours", SETTLEMENT_OVERLAP_HOURS))
+        # Hourly and daily totals are written alongside the intervals unless turned off
+        self.rollups = octopus_config.get("rollups", True)
+
+        self.rate_cache = RateCache(octopus_config.get("rate_cache", ".octopus-rates.json"), self.octopus.get_tariff_rates)
 
-    def get_account_info(self):
-        self.account = self.octopus.get_account()
         # Legacy Bulb tariff not returned from Octopus API
-        self.electricity_rates = {
-            "E-1R-BULB-SEG-FIX-V1-21-04-01-J": [
+        self.legacy_rates = {
+            "E-1R-BULB-SEG-FIX-V1-21-04-01-J": ValidityIndex.from_records([
                 {'value_exc_vat': 0.0557, 'value_inc_vat': 0.0557, 'valid_from': '1970-01-01T00:00:00Z', 'valid_to': None}
-            ]
+            ])
         }
-        self.gas_rates = {}
+
+    def start(self, resync_days=None):
+        self.get_account_info()
+        self.today = date.today()
+        self.resync_days = resync_days
+
+    def poll(self):
+        new_today = date.today()
+
+        # After a date roll do one last scan of the previous day for completeness
+        if new_today != self.today:
+            self.get_account_info()
+            self.today = new_today
+
+        # Get current value
+        self.process_snapshot(self.resync_days)
+        self.resync_days = None
+
+    def get_account_info(self):
+        self.account = self.octopus.get_account()
+        self.refresh_rates()
+
+    def refresh_rates(self):
+        agreements = [agreement
+                      for p in self.account["properties"]
+                      for meter_point in p["electricity_meter_points"] + p["gas_meter_points"]
+                      for agreement in meter_point["agreements"]]
+        tariff_codes = {agreement["tariff_code"] for agreement in agreements} - set(self.legacy_rates)
+        self.rate_cache.retain(tariff_codes)
+        # Rates of tariffs from agreements that have ended will not change again
+        now = datetime.now(tz=timezone.utc)
+        for tariff_code in tariff_codes:
+            if tariff_code not in self.rate_cache.windows or any(
+                    agreement["tariff_code"] == tariff_code and
+                    (not agreement["valid_to"] or parse_timestamp(agreement["valid_to"]) > now)
+                    for agreement in agreements):
+                self.rate_cache.refresh(tariff_code)
+        self.rate_cache.save()
 
     def get_electricity_tariff(self, tariff_code: str):
-        if tariff_code not in self.electricity_rates:
-            self.electricity_rates[tariff_code] = self.octopus.get_electricity_tariff_rates(tariff_code)
-        return self.electricity_rates[tariff_code]
+        if tariff_code in self.legacy_rates:
+            return self.legacy_rates[tariff_code]
+        return self.rate_cache.get(tariff_code)
 
     def get_gas_tariff(self, tariff_code: str):
-        if tariff_code not in self.gas_rates:
-            self.gas_rates[tariff_code] = self.octopus.get_gas_tariff_rates(tariff_code)
-        return self.gas_rates[tariff_code]
+        return self.rate_cache.get(tariff_code)
 
-    def process_snapshot(self):
+    def process_snapshot(self, resync_days=None):
         self.logger.info(f"Processing snapshot")
-        self.process_electricity()
-        self.process_gas()
+        self.process_electricity(resync_days)
+        self.process_gas(resync_days)
         self.logger.info(f"Snapshot complete")
 
-    def process_electricity(self):
+    def process_electricity(self, resync_days=None):
         meter_points = [e for p in self.account["properties"] for e in p["electricity_meter_points"]]
         for meter_point in meter_points:
             is_export = meter_point["is_export"]
@@ -169,10 +351,12 @@ class OctopusScraper:
             for meter in meter_point["meters"]:
                 meter_serial_number = meter["serial_number"]
                 self.logger.info(f"Processing electricity meter {mpan} {meter_serial_number} (export={is_export})")
-                usage = self.octopus.get_electricity_usage(mpan, meter_serial_number)
-                self.process_meter_usage(False, is_export, mpan, meter_serial_number, agreements, self.get_electricity_tariff, usage)
+                period_from = self.usage_period_from(mpan, meter_serial_number, resync_days)
+                usage = self.octopus.get_electricity_usage(mpan, meter_serial_number, period_from)
+                self.process_meter_usage(False, is_export, mpan, meter_serial_number, agreements, self.get_electricity_tariff, usage,
+                                         period_from)
 
-    def process_gas(self):
+    def process_gas(self, resync_days=None):
         meter_points = [e for p in self.account["properties"] for e in p["gas_meter_points"]]
         for meter_point in meter_points:
             mprn = meter_point["mprn"]
@@ -180,26 +364,49 @@ class OctopusScraper:
             for meter in meter_point["meters"]:
                 meter_serial_number = meter["serial_number"]
                 self.logger.info(f"Processing gas meter {mprn} {meter_serial_number}")
-                usage = self.octopus.get_gas_usage(mprn, meter_serial_number)
-                self.process_meter_usage(True, False, mprn, meter_serial_number, agreements, self.get_gas_tariff, usage)
-
-    def process_meter_usage(self, is_gas, is_export, meter_point_id, meter_serial_number, agreements, get_tariff, usage):
-        self.logger.info(f"Processing {len(usage)} records for meter {meter_serial_number}")
+                period_from = self.usage_period_from(mprn, meter_serial_number, resync_days)
+                usage = self.octopus.get_gas_usage(mprn, meter_serial_number, period_from)
+                self.process_meter_usage(True, False, mprn, meter_serial_number, agreements, self.get_gas_tariff, usage,
+                                         period_from)
+
+    def usage_period_from(self, meter_point_id, meter_serial_number, resync_days=None):
+        now = datetime.now(tz=timezone.utc)
+        if resync_days is not None:
+            return now - timedelta(resync_days)
+
+        # Fetch from just before the last interval written
+        watermark = self.checkpoints.watermark("octopus", f"{meter_point_id}/{meter_serial_number}")
+        if watermark is not None:
+            return datetime.fromtimestamp(watermark, tz=timezone.utc) - self.settlement_overlap
+
+        # Otherwise from the first UTC day not yet known to be complete
+        today = now.date()
+        days = self.checkpoints.backfill_days("octopus", f"{meter_point_id}/{meter_serial_number}", today, BACKFILL_DAYS)
+        start = days[0] if days else today
+        return datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+
+    def process_meter_usage(self, is_gas, is_export, meter_point_id, meter_serial_number, agreements, get_tariff, usage,
+                            period_from=None):
+        agreements = ValidityIndex.from_records(agreements)
+        hours = {}  # hour start -> totals of the intervals fetched
+        days = set()
+        records = 0
+        last_interval_end = None
         for interval in usage:
-            interval_start = dateutil.parser.isoparse(interval["interval_start"])
-            interval_end = dateutil.parser.isoparse(interval["interval_end"])
+            records += 1
+            interval_start = parse_timestamp(interval["interval_start"])
+            interval_end = parse_timestamp(interval["interval_end"])
             energy = interval["consumption"]  # kWh
             duration = (interval_end - interval_start).total_seconds()
             power = energy * 1000 / duration  # Average Watts
-            tariff_code = next(agreement["tariff_code"]
-                               for agreement in agreements
-                               if is_current(interval_start, agreement))
-            tariff_rates = get_tariff(tariff_code)
-            rate_pence = next((rate["value_inc_vat"]
-                              for rate in tariff_rates
-                              if is_current(interval_start, rate)), None)
-            if rate_pence is None:
+            agreement = agreements.find(interval_start)
+            if agreement is None:
+                raise KeyError(f"Agreement not found for meter {meter_serial_number} at {interval_start}")
+            tariff_code = agreement["tariff_code"]
+            rate = get_tariff(tariff_code).find(interval_start)
+            if rate is None:
                 raise KeyError(f"Rate not found for tariff {tariff_code} at {interval_start}")
+            rate_pence = rate["value_inc_vat"]
             cost = energy * rate_pence / 100
 
             self.influxdb.write_snapshot(
@@ -215,6 +422,42 @@ class OctopusScraper:
                 cost=cost,
                 is_gas=is_gas
             )
+            if self.rollups:
+                timestamp = int(interval_start.timestamp())
+                totals = hours.setdefault(timestamp - timestamp % HOUR, {"energy": 0.0, "cost": 0.0})
+                totals["energy"] += energy
+                totals["cost"] += cost
+            days.add(interval_start.astimezone(timezone.utc).date())
+            last_interval_end = max(last_interval_end or interval_end, interval_end)
+        self.logger.info(f"Processed {records} records for meter {meter_serial_number}")
+        if self.rollups and hours:
+            self.write_rollups(is_gas, is_export, meter_point_id, meter_serial_number, hours, period_from)
+
+        if last_interval_end is not None:
+            self.checkpoints.advance_watermark("octopus", f"{meter_point_id}/{meter_serial_number}",
+                                               last_interval_end.timestamp())
+
+        # Consumption arrives a day or more late, so only days followed by later data are complete
+        for day in sorted(days):
+            self.checkpoints.mark_day("octopus", f"{meter_point_id}/{meter_serial_number}", day,
+                                      complete=day < max(days))
+
+    def write_rollups(self, is_gas, is_export, meter_point_id, meter_serial_number, hours, period_from):
+        """Save the totals of the hours fetched in full, then rewrite the rollups of their days from the saved hours,
+        so each fetch only needs the intervals after the watermark."""
+        device = f"{meter_point_id}/{meter_serial_number}"
+        since = period_from.timestamp() if period_from is not None else 0
+        # An hour the fetch started partway through keeps the totals saved from the fetch that covered all of it
+        complete_hours = {start: totals for start, totals in hours.items() if start >= since}
+        self.checkpoints.save_rollups("octopus", device, complete_hours, ROLLUP_RETENTION)
+        tags = {"account": self.account["number"], "mpan": meter_point_id, "meter": meter_serial_number,
+                "is_export": is_export, "is_gas": is_gas}
+        rollup = EnergyRollup(ROLLUP_LINES)
+        first_day = min(hours) - min(hours) % DAY
+        for start, totals in self.checkpoints.rollups("octopus", device, first_day, max(hours) + DAY).items():
+            rollup.add(tags, start, totals)
+        self.influxdb.write_rollup(rollup)
+
 
 def daterange(start_date, end_date):
     for n in range(int((end_date - start_date).days)):
@@ -223,26 +466,21 @@ def daterange(start_date, end_date):
 
 @retry.retry(tries=10, delay=60)
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resync-days", type=int,
+                        help="Re-fetch and rewrite this many days of consumption on the first poll, "
+                             "instead of only intervals after the last one written")
+    args = parser.parse_args()
+
     with open(".solarman-scraper.yml", "r") as yamlfile:
         config = yaml.load(yamlfile, Loader=yaml.FullLoader)
     scraper = OctopusScraper(config)
+    profiling.instrument(scraper, config.get("profiling"))
+    scraper.start(args.resync_days)
 
-    scraper.get_account_info()
-    today = date.today()
     while True:
-
-        new_today = date.today()
-
-        # After a date roll do one last scan of the previous day for completeness
-        if new_today != today:
-            scraper.get_account_info()
-            today = new_today
-
-        # Get current value
-        scraper.process_snapshot()
-
-        # No need to poll more than once every 4 hours, data updates daily
-        time.sleep(4*60*60)
+        scraper.poll()
+        time.sleep(scraper.interval)
 
 
 if __name__ == '__main__':
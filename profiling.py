@@ -0,0 +1,92 @@
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+# Scrape cycle methods profiled on scrapers and their InfluxDB writers, when present
+PROFILED_METHODS = ["process_snapshot", "process_day", "process_meter_usage", "write_data"]
+
+_tracemalloc_thread = None
+
+
+class CycleProfiler:
+    """Runs the first N calls of the wrapped methods under cProfile, writing a .pstats file for each."""
+
+    logger = logging.getLogger('CycleProfiler')
+
+    def __init__(self, path, cycles):
+        self.path = path
+        self.cycles = cycles
+        self.taken = 0
+        self.lock = threading.Lock()
+        # Calls made from within a profiled call are already included in its profile
+        self.local = threading.local()
+        os.makedirs(self.path, exist_ok=True)
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cycle = None if getattr(self.local, "active", False) else self._take()
+            if cycle is None:
+                return fn(*args, **kwargs)
+            profiler = cProfile.Profile()
+            self.local.active = True
+            try:
+                return profiler.runcall(fn, *args, **kwargs)
+            finally:
+                self.local.active = False
+                path = os.path.join(self.path, f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{cycle}.pstats")
+                profiler.dump_stats(path)
+                self.logger.info(f"Wrote profile of {name} to {path}")
+
+        return wrapper
+
+    def _take(self):
+        """The number of the next cycle to profile, or None once all have been taken."""
+        with self.lock:
+            if self.taken >= self.cycles:
+                return None
+            self.taken += 1
+            return self.taken
+
+
+def instrument(scraper, profiling_config):
+    """Profile the scraper's cycles and trace allocations as configured. Methods are only wrapped when profiling
+    is enabled, so there is no overhead otherwise."""
+    if not profiling_config:
+        return
+    cycles = profiling_config.get("cycles", 0)
+    if cycles:
+        profiler = CycleProfiler(profiling_config.get("path", "profiles"), cycles)
+        for owner in [scraper, getattr(scraper, "influxdb", None)]:
+            for method in PROFILED_METHODS:
+                if owner is not None and hasattr(owner, method):
+                    setattr(owner, method, profiler.wrap(f"{type(owner).__name__}.{method}", getattr(owner, method)))
+    if profiling_config.get("tracemalloc"):
+        start_tracemalloc(profiling_config.get("tracemalloc_interval", 60 * 60), profiling_config.get("tracemalloc_top", 10))
+
+
+def start_tracemalloc(interval, top):
+    """Log the top allocation growth sites every interval seconds, from a background thread (once per process)."""
+    global _tracemalloc_thread
+    if _tracemalloc_thread is not None:
+        return
+    logger = logging.getLogger('Tracemalloc')
+    tracemalloc.start()
+
+    def run():
+        previous = tracemalloc.take_snapshot()
+        while True:
+            time.sleep(interval)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            growth = [stat for stat in snapshot.compare_to(previous, "lineno") if stat.size_diff > 0][:top]
+            logger.info(f"Traced memory {current / 1024 / 1024:.1f} MB (peak {peak / 1024 / 1024:.1f} MB), "
+                        f"top growth in the last {interval}s:\n" + "\n".join(str(stat) for stat in growth))
+            previous = snapshot
+
+    _tracemalloc_thread = threading.Thread(target=run, name="Tracemalloc", daemon=True)
+    _tracemalloc_thread.start()
@@ -0,0 +1,47 @@
+from line_protocol import LineSerializer
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+def rollup_serializers(measurement, tag_keys, fields):
+    """Serializers for the {measurement}_hourly and {measurement}_daily rollup measurements, all float fields."""
+    field_types = dict.fromkeys(fields, float)
+    return (LineSerializer(f"{measurement}_hourly", tag_keys, field_types),
+            LineSerializer(f"{measurement}_daily", tag_keys, field_types))
+
+
+class EnergyRollup:
+    """Hourly and daily totals of energy fields, summed as samples are added and written as points timestamped
+    at the start of each hour and day, so long-range panels read a few pre-aggregated points instead of every sample."""
+
+    def __init__(self, serializers):
+        self.hourly, self.daily = serializers
+        self.hours = {}  # (tags, hour start) -> {field: total}
+        self.days = {}   # (tags, day start) -> {field: total}
+
+    def add(self, tags, timestamp, values, day=None):
+        """Adds a sample's values to the hour containing timestamp (in seconds) and to its day, which is the UTC day
+        unless day, the start of the day in seconds, is given."""
+        key = tuple(sorted(tags.items()))
+        hour = timestamp - timestamp % HOUR
+        if day is None:
+            day = timestamp - timestamp % DAY
+        for totals in (self.hours.setdefault((key, hour), {}), self.days.setdefault((key, day), {})):
+            for field, value in values.items():
+                totals[field] = totals.get(field, 0.0) + value
+
+    def lines(self, since=0):
+        """Line protocol for every day, and for the hours ending after since, in seconds precision."""
+        hours = {bucket: totals for bucket, totals in self.hours.items() if bucket[1] + HOUR > since}
+        return bucket_lines(self.hourly, hours) + bucket_lines(self.daily, self.days)
+
+
+def bucket_lines(serializer, buckets):
+    series = {}
+    lines = []
+    for (key, start), totals in buckets.items():
+        if key not in series:
+            series[key] = serializer.series(**dict(key))
+        lines.append(serializer.line(series[key], totals, start))
+    return lines
@@ -1,17 +1,58 @@
+import argparse
+import calendar
+import contextvars
 import json
+import os
+import threading
 import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, date
 from hashlib import sha256
 
 import logging
 import retry
 import requests
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from requests.adapters import HTTPAdapter
+from influxdb_client import Point, WritePrecision
+
+from checkpoints import CheckpointStore
+from influxdb_writer import WritePipeline
+from line_protocol import LineSerializer
+from rollups import EnergyRollup, rollup_serializers
+import metrics
+import profiling
 
 SOLARMAN_API = 'https://globalapi.solarmanpv.com'
 
+# Days loaded on a first run, before any checkpoints exist
+BACKFILL_DAYS = 7
+
+# Login tokens are replaced this many seconds (or a tenth of their lifetime) before they expire,
+# and last this long if the API doesn't say
+TOKEN_REFRESH_MARGIN = 24 * 60 * 60
+DEFAULT_TOKEN_LIFETIME = 7 * 24 * 60 * 60
+
+# Plant timezone and device list saved at startup are fetched again after this many seconds
+METADATA_MAX_AGE = 24 * 60 * 60
+
+# Only transport and response errors are retried; an open circuit or a passed deadline fails straight away
+RETRYABLE_ERRORS = (requests.RequestException, ValueError)
+
+# Seconds between checks for the month summaries, which are reloaded once a day
+MONTH_TASK_INTERVAL = 60 * 60
+
+# Deadline of the collection task running in this context, copied into the inverter workers it starts
+task_deadline = contextvars.ContextVar("task_deadline", default=None)
+
+TASK_RUNS = metrics.REGISTRY.counter(
+    "solarman_task_runs_total", "Solarman collection task runs by outcome: ok, failed, abandoned or skipped",
+    ("task", "outcome"))
+TASK_SECONDS = metrics.REGISTRY.histogram(
+    "solarman_task_seconds", "Duration of each Solarman collection task run, whatever its outcome", ("task",))
+CIRCUITS_OPENED = metrics.REGISTRY.counter(
+    "solarman_circuits_opened_total", "Times a Solarman endpoint started failing fast", ("endpoint",))
+
 FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
@@ -47,20 +88,172 @@ SNAPSHOT_POWER_FIELDS = {
     'purchasePower':   'powerPurchase'
 }
 
+# Signed powers of snapshots derived from the day data, which keep the day data's signs (battery charging and grid
+# export are positive) under their own names, as realTime's batteryPower and gridPower may not share them
+DAY_SNAPSHOT_POWER_FIELDS = {
+    'dayBatteryPower': 'powerBatteryDay',
+    'dayGridPower':    'powerGridDay',
+}
+
+# Line protocol for the measurements written from the maps above, all float fields
+DAY_DETAIL_LINES = LineSerializer(
+    "solarman", ["plant_id", "device_sn"],
+    dict.fromkeys([*DAY_DETAIL_FIELDS.values(), 'energy_batter_in', 'energy_batter_out', 'power_buy', 'power_sell'],
+                  float))
+DAY_SUMMARY_LINES = LineSerializer(
+    "solarman_daily_summary", ["plant_id", "device_sn"], dict.fromkeys(DAY_SUMMARY_FIELDS.values(), float))
+SNAPSHOT_POWER_LINES = LineSerializer(
+    "solarman_power", ["plant_id"],
+    dict.fromkeys([*SNAPSHOT_POWER_FIELDS.values(), *DAY_SNAPSHOT_POWER_FIELDS.values()], float))
+
+# Hourly and daily energy totals in kWh, written to solarman_hourly and solarman_daily
+ROLLUP_LINES = rollup_serializers(
+    "solarman", ["plant_id", "device_sn"],
+    ['generation', 'consumption', 'import', 'export', 'self_consumption', 'battery_charge', 'battery_discharge'])
+
+# Rollup fields taken from the increase in the inverter's daily counters (kWh) between samples
+ROLLUP_COUNTERS = {
+    'import': 'Etdy_pu1',
+    'export': 't_gc_tdy1',
+    'battery_charge': 'Etdy_cg1',
+    'battery_discharge': 'Etdy_dcg1',
+}
+
+# Seconds of power each day sample stands for: the time since the previous sample, up to MAX_SAMPLE_SECONDS,
+# or SAMPLE_SECONDS for the first sample of the day
+SAMPLE_SECONDS = 5 * 60
+MAX_SAMPLE_SECONDS = 15 * 60
+
+
+class SessionCache:
+    """A JSON file of values kept between runs, such as the login token and plant metadata, with when each was saved."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # A corrupt cache only costs a fresh login
+                pass
+
+    def get(self, key, max_age=None):
+        entry = self.entries.get(key)
+        if entry is None or (max_age is not None and entry["saved_at"] < time.time() - max_age):
+            return None
+        return entry["value"]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = {"value": value, "saved_at": time.time()}
+            tmp_path = f"{self.path}.tmp"
+            # Holds an access token, so only readable by this user
+            with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fails calls to an endpoint fast for reset_timeout seconds once it has failed several times in a row,
+    then lets a single call through to find out whether it has recovered."""
+
+    logger = logging.getLogger('CircuitBreaker')
+
+    def __init__(self, endpoint, failures, reset_timeout):
+        self.endpoint = endpoint
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.time() < self.opened_at + self.reset_timeout:
+                raise CircuitOpenError(f"{self.endpoint} failed {self.failures} times in a row, not calling it for now")
+            self.trial = True
+        self.logger.info(f"Trying {self.endpoint} again")
+
+    def success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                self.logger.info(f"{self.endpoint} has recovered")
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.max_failures):
+                self.logger.warning(f"{self.endpoint} failed {self.failures} times in a row, "
+                                    f"failing fast for {self.reset_timeout}s")
+                CIRCUITS_OPENED.inc(self.endpoint)
+                self.opened_at = time.time()
+                self.trial = False
+
+
+def request_timeout():
+    """The 60s request timeout, shortened to what is left before the current task's deadline."""
+    deadline = task_deadline.get()
+    return 60 if deadline is None else max(1, min(60, deadline - time.time()))
+
 
 class SolarmanClient:
 
     logger = logging.getLogger('SolarmanClient')
 
-    def __init__(self, login_config):
+    def __init__(self, login_config, max_connections=10, cache: SessionCache = None, breaker_config=None):
+        # Endpoint path -> CircuitBreaker, created on first use
+        breaker_config = breaker_config or {}
+        self.breakers = {}
+        self.breaker_config = {
+            "failures": breaker_config.get("failures", 5),
+            "reset_timeout": breaker_config.get("reset_minutes", 5) * 60,
+        }
         self.headers = {
             "Content-Type": "application/json",
             "User-Agent": "curl"
         }
         self.login_config = login_config
         self.session = requests.session()
-        self.auth_headers = self.headers | {"Authorization": f"Bearer {self.login()}"}
-
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_connections))
+        self.cache = cache
+        self.token_key = f"token:{login_config['client_id']}:{login_config['email']}"
+        self.lock = threading.Lock()
+        cached = cache.get(self.token_key) if cache else None
+        if cached and cached["refresh_at"] > time.time():
+            self.logger.info("Using saved login token")
+            self.token, self.refresh_at = cached["access_token"], cached["refresh_at"]
+        else:
+            self.relogin()
+
+    def relogin(self, stale_token=None):
+        """Log in again, unless another thread already replaced stale_token."""
+        with self.lock:
+            if stale_token is not None and stale_token != self.token:
+                return
+            token, expires_in = self.login()
+            self.token = token
+            self.refresh_at = time.time() + expires_in - min(TOKEN_REFRESH_MARGIN, expires_in / 10)
+            if self.cache:
+                self.cache.put(self.token_key, {"access_token": self.token, "refresh_at": self.refresh_at})
+
+    @metrics.timed
     def login(self):
         encoded_password = sha256(self.login_config['password'].encode('utf-8')).hexdigest()
         r = self.session.post(
@@ -75,151 +268,289 @@ class SolarmanClient:
         )
         r.raise_for_status()
         data = r.json()
-        token = data['access_token']
-        return token
-
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
-    def get_plant_info(self, plant_id):
+        return data['access_token'], int(data.get('expires_in', DEFAULT_TOKEN_LIFETIME))
+
+    def post(self, path, payload):
+        """POST to the API unless the current task's deadline has passed or the endpoint's circuit is open."""
+        deadline = task_deadline.get()
+        if deadline is not None and time.time() > deadline:
+            raise DeadlineExceeded(f"Deadline passed before calling {path}")
+        breaker = self.breakers.setdefault(path, CircuitBreaker(path, **self.breaker_config))
+        breaker.before_call()
+        try:
+            r = self.authorized_post(path, payload)
+        except Exception:
+            breaker.failure()
+            raise
+        breaker.success()
+        return r
+
+    def authorized_post(self, path, payload):
+        """POST to the API, refreshing the token when it is about to expire, and logging in again and retrying
+        once if the token has been rejected."""
+        if self.refresh_at < time.time():
+            self.logger.info("Login token about to expire, refreshing")
+            self.relogin(self.token)
+        token = self.token
+        r = self._post(path, payload, token)
+        if r is None:
+            self.logger.warning(f"Login token rejected by {path}, logging in again")
+            self.relogin(token)
+            r = self._post(path, payload, self.token)
+            if r is None:
+                raise requests.HTTPError(f"Solarman rejected a new login token for {path}")
+        return r
+
+    def _post(self, path, payload, token):
         r = self.session.post(
-            f"{SOLARMAN_API}/station/v1.0/base?language=en",
-            headers=self.auth_headers,
-            json={"stationId": plant_id},
-            timeout=60
+            f"{SOLARMAN_API}{path}?language=en",
+            headers=self.headers | {"Authorization": f"Bearer {token}"},
+            json=payload,
+            timeout=request_timeout()
         )
+        if r.status_code == 401:
+            return None
         r.raise_for_status()
-        data = r.json()
-        return data
+        try:
+            return r.json()
+        except ValueError:
+            # Solarman returns HTML instead of JSON when logged out
+            return None
+
+    @retry.retry(RETRYABLE_ERRORS, tries=10, delay=1, backoff=2, max_delay=60, logger=logger)
+    @metrics.timed
+    def get_plant_info(self, plant_id):
+        return self.post("/station/v1.0/base", {"stationId": plant_id})
 
+    @metrics.timed
     def get_device_info(self, plant_id):
-        r = self.session.post(
-            f"{SOLARMAN_API}/station/v1.0/device?language=en",
-            headers=self.auth_headers,
-            json={"stationId": plant_id},
-            timeout=60
-        )
-        r.raise_for_status()
-        data = r.json()
-        return data["deviceListItems"]
+        return self.post("/station/v1.0/device", {"stationId": plant_id})["deviceListItems"]
 
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @retry.retry(RETRYABLE_ERRORS, tries=10, delay=1, backoff=2, max_delay=60, logger=logger)
+    @metrics.timed
     def get_plant_snapshot(self, plant_id):
-        r = self.session.post(
-            f"{SOLARMAN_API}/station/v1.0/realTime?language=en",
-            headers=self.auth_headers,
-            json={"stationId": plant_id},
-            timeout=60
-        )
-        r.raise_for_status()
-        data = r.json()
-        return data
+        return self.post("/station/v1.0/realTime", {"stationId": plant_id})
 
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @retry.retry(RETRYABLE_ERRORS, tries=10, delay=1, backoff=2, max_delay=60, logger=logger)
+    @metrics.timed
     def get_day_data(self, device, day: str):
-        r = self.session.post(
-            f"{SOLARMAN_API}/device/v1.0/historical?language=en",
-            headers=self.auth_headers,
-            json={
-                "deviceId": device["deviceId"],
-                "deviceSn": device["deviceSn"],
-                "startTime": day,
-                "endTime": day,
-                "timeType": 1
-            },
-            timeout=60
-        )
-        r.raise_for_status()
-        data = r.json()
-        return data
-
-    @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+        day_data = self.post("/device/v1.0/historical", {
+            "deviceId": device["deviceId"],
+            "deviceSn": device["deviceSn"],
+            "startTime": day,
+            "endTime": day,
+            "timeType": 1
+        })
+        # Left out of the response for a day without samples
+        return day_data | {"paramDataList": day_data.get("paramDataList") or []}
+
+    @retry.retry(RETRYABLE_ERRORS, tries=10, delay=1, backoff=2, max_delay=60, logger=logger)
+    @metrics.timed
     def get_daily_summary_data(self, device, start_date: str, end_date: str):
-        r = self.session.post(
-            f"{SOLARMAN_API}/device/v1.0/historical?language=en",
-            headers=self.auth_headers,
-            json={
-                "deviceId": device["deviceId"],
-                "deviceSn": device["deviceSn"],
-                "startTime": start_date,
-                "endTime": end_date,
-                "timeType": 2
-            },
-            timeout=60
-        )
-        r.raise_for_status()
-        data = r.json()
-        return data
+        return self.post("/device/v1.0/historical", {
+            "deviceId": device["deviceId"],
+            "deviceSn": device["deviceSn"],
+            "startTime": start_date,
+            "endTime": end_date,
+            "timeType": 2
+        })
+
+
+class TokenBucket:
+    """Limits callers to an average of rate calls per second, allowing bursts of up to capacity calls."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative, queueing later callers behind this one
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AdaptiveSchedule:
+    """Chooses when to poll next from when the inverter last reported, and how much its power is changing."""
+
+    def __init__(self, base_interval, min_interval, max_staleness, margin, flat_watts):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+        self.margin = margin
+        self.flat_watts = flat_watts
+        self.report_period = None  # shortest time seen between reports
+        self.last_update = None
+        self.last_powers = None
+        self.flat_reports = 0
+        self.late_checks = 0  # checks since a report was expected, e.g. overnight or while the logger is offline
+
+    def update(self, last_update, powers):
+        """Records a snapshot's lastUpdateTime and power readings, returning whether it is a new report."""
+        if last_update == self.last_update:
+            return False
+        if self.last_update is not None and last_update > self.last_update:
+            gap = last_update - self.last_update
+            self.report_period = gap if self.report_period is None else min(self.report_period, gap)
+        if self.last_powers is not None and all(abs(power - last_power) < self.flat_watts
+                                                for power, last_power in zip(powers, self.last_powers)):
+            self.flat_reports += 1
+        else:
+            self.flat_reports = 0
+        self.last_update = last_update
+        self.last_powers = powers
+        self.late_checks = 0
+        return True
+
+    def next_interval(self, now):
+        if self.report_period is None:
+            return self.base_interval
+        # Skip more reports the longer power stays flat, doubling each time
+        expected = self.last_update + self.report_period * 2 ** min(self.flat_reports, 10) + self.margin
+        if expected - now >= self.min_interval:
+            return min(expected - now, self.max_staleness)
+        # A late report is checked for again after min_interval, doubling each time it still hasn't come
+        interval = self.min_interval * 2 ** min(self.late_checks, 10)
+        self.late_checks += 1
+        return min(interval, self.max_staleness)
+
+
+class ScheduledTask:
+    """A collection job started in the background every interval seconds, abandoned at its next API call once it
+    has been running for deadline seconds. A run that comes due while the previous one is still going is skipped."""
+
+    def __init__(self, name, run, interval, deadline):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self.deadline = deadline
+        self.next_run = 0
+        self.future = None
+        self.last_success = None  # epoch seconds the last run that completed finished
+
+    def running(self):
+        return self.future is not None and not self.future.done()
 
 
 class InfluxDBWriter:
 
     logger = logging.getLogger('InfluxDBWriter')
 
-    def __init__(self, influxdb_config):
-        self.influxdb_config = influxdb_config
-        self.client = InfluxDBClient(**influxdb_config)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
-
-    @retry.retry(tries=10, delay=1, logger=logger)
-    def write_day_chart_data(self, plant_id, measurement_name, day_data):
-        device_sn = day_data["deviceSn"]
-        chart_data = day_data["paramDataList"]
-        for ts_entry in chart_data:
-            data = {d["key"]: (float(d["value"])/1000.0 if d.get("unit") == 'W' else float(d["value"]))
-                    for d in ts_entry["dataList"]
-                    if d["key"] in DAY_DETAIL_FIELDS and "value" in d}
-            ts = datetime.utcfromtimestamp(int(ts_entry['collectTime']))
-            point = Point(measurement_name).tag("plant_id", plant_id).tag("device_sn", device_sn).time(ts, WritePrecision.S)
-            for data_key, write_key in DAY_DETAIL_FIELDS.items():
-                point.field(write_key, data.get(data_key, 0.0))
-
-            # Positive and negative values stored in separate series
-            battery_charge_discharge = data.get('Pcg_dcg1', 0.0)
-            if battery_charge_discharge > 0:
-                point.field('energy_batter_in', battery_charge_discharge)
-                point.field('energy_batter_out', 0.0)
-            else:
-                point.field('energy_batter_in', 0.0)
-                point.field('energy_batter_out', battery_charge_discharge)
-
-            grid_power = data.get('PG_Pt1', 0.0)
-            if grid_power > 0:
-                point.field('power_buy', 0.0)
-                point.field('power_sell', grid_power)
-            else:
-                point.field('power_buy', -grid_power)
-                point.field('power_sell', 0.0)
-
-            self.write_api.write("solarman", self.client.org, point)
-
-    @retry.retry(tries=10, delay=1, logger=logger)
-    def write_daily_summary_data(self, plant_id, measurement_name, month_data):
-        device_sn = month_data["deviceSn"]
-        chart_data = month_data["paramDataList"]
-        for day_summary in chart_data:
-            self.write_day_summary_data(plant_id, device_sn, measurement_name, day_summary)
-
-    @retry.retry(tries=10, delay=1, logger=logger)
-    def write_day_summary_data(self, plant_id, device_sn, measurement_name, day_summary):
-        date_ts = datetime.fromisoformat(day_summary["collectTime"])
+    def __init__(self, pipeline: WritePipeline):
+        self.pipeline = pipeline
+
+    def write_points(self, points):
+        self.pipeline.write("solarman", points)
+
+    def write_lines(self, lines):
+        self.pipeline.write_lines("solarman", WritePrecision.S, lines)
+
+    def write_day_chart_data(self, plant_id, day_data):
+        self.write_lines(self.day_chart_lines(plant_id, day_data))
+
+    def day_chart_lines(self, plant_id, day_data):
+        series = DAY_DETAIL_LINES.series(plant_id=plant_id, device_sn=day_data["deviceSn"])
+        return [DAY_DETAIL_LINES.line(series, self.day_chart_fields(ts_entry), int(ts_entry['collectTime']))
+                for ts_entry in day_data["paramDataList"]]
+
+    def day_chart_fields(self, ts_entry):
+        data = {d["key"]: (float(d["value"])/1000.0 if d.get("unit") == 'W' else float(d["value"]))
+                for d in ts_entry["dataList"]
+                if d["key"] in DAY_DETAIL_FIELDS and "value" in d}
+        fields = {write_key: data.get(data_key, 0.0) for data_key, write_key in DAY_DETAIL_FIELDS.items()}
+
+        # Positive and negative values stored in separate series
+        battery_charge_discharge = data.get('Pcg_dcg1', 0.0)
+        if battery_charge_discharge > 0:
+            fields['energy_batter_in'] = battery_charge_discharge
+            fields['energy_batter_out'] = 0.0
+        else:
+            fields['energy_batter_in'] = 0.0
+            fields['energy_batter_out'] = battery_charge_discharge
+
+        grid_power = data.get('PG_Pt1', 0.0)
+        if grid_power > 0:
+            fields['power_buy'] = 0.0
+            fields['power_sell'] = grid_power
+        else:
+            fields['power_buy'] = -grid_power
+            fields['power_sell'] = 0.0
+        return fields
+
+    def write_day_rollups(self, plant_id, day_data, date, since=0):
+        self.write_lines(self.day_rollup_lines(plant_id, day_data, date, since))
+
+    def day_rollup_lines(self, plant_id, day_data, date, since=0):
+        """Hourly and daily energy totals for one device's day data. Import, export and battery energy are the
+        increases in the inverter's daily counters, generation and consumption are integrated from power. Each
+        sample's energy goes to the hour its interval starts in, and the daily point is timestamped like
+        solarman_daily_summary. Only hours ending after the interval of the first sample from since are included."""
+        rollup = EnergyRollup(ROLLUP_LINES)
+        tags = {"plant_id": plant_id, "device_sn": day_data["deviceSn"]}
+        day_start = calendar.timegm(date.timetuple())
+        previous = None
+        counters = dict.fromkeys(ROLLUP_COUNTERS, 0.0)
+        first_interval = None
+        for ts_entry in sorted(day_data["paramDataList"], key=lambda ts_entry: int(ts_entry["collectTime"])):
+            timestamp = int(ts_entry["collectTime"])
+            seconds = min(timestamp - previous if previous is not None else SAMPLE_SECONDS, MAX_SAMPLE_SECONDS)
+            previous = timestamp
+            interval_start = timestamp - seconds
+            if timestamp >= since and first_interval is None:
+                first_interval = interval_start
+            fields = self.day_chart_fields(ts_entry)
+            reported = {d["key"] for d in ts_entry["dataList"] if "value" in d}
+            values = {
+                'generation': fields['power'] * seconds / 3600,
+                'consumption': fields['power_useage'] * seconds / 3600,
+            }
+            for name, data_key in ROLLUP_COUNTERS.items():
+                if data_key not in reported:
+                    # Keep the last reading, so the next one isn't counted from zero
+                    values[name] = 0.0
+                    continue
+                value = fields[DAY_DETAIL_FIELDS[data_key]]
+                # A counter that went down was reset, e.g. by the inverter restarting
+                values[name] = value - counters[name] if value >= counters[name] else value
+                counters[name] = value
+            values['self_consumption'] = max(values['generation'] - values['export'], 0.0)
+            rollup.add(tags, interval_start, values, day=day_start)
+        if first_interval is None:
+            return []
+        return rollup.lines(first_interval)
+
+    def write_daily_summary_data(self, plant_id, month_data):
+        self.write_lines(self.daily_summary_lines(plant_id, month_data))
+
+    def daily_summary_lines(self, plant_id, month_data):
+        series = DAY_SUMMARY_LINES.series(plant_id=plant_id, device_sn=month_data["deviceSn"])
+        return [self.day_summary_line(series, day_summary) for day_summary in month_data["paramDataList"]]
+
+    def day_summary_line(self, series, day_summary):
+        timestamp = calendar.timegm(datetime.fromisoformat(day_summary["collectTime"]).timetuple())
         data = {d["key"]: (float(d["value"])/1000 if d.get("unit") == 'W' else float(d["value"]))
                 for d in day_summary["dataList"]
                 if d["key"] in DAY_SUMMARY_FIELDS and "value" in d}
-        point = Point(measurement_name).tag("plant_id", plant_id).tag("device_sn", device_sn).time(date_ts, WritePrecision.S)
-        for data_key, write_key in DAY_SUMMARY_FIELDS.items():
-            point.field(write_key, data.get(data_key, 0.0))
-        self.write_api.write("solarman", self.client.org, point)
-
-    @retry.retry(tries=10, delay=1, logger=logger)
-    def write_plant_snapshot(self, plant_id, measurement_name, plant_snapshot):
-        ts = datetime.utcfromtimestamp(int(plant_snapshot['lastUpdateTime']))
-        self.logger.info(f"Writing snapshot for {ts}")
-        point = Point(measurement_name).tag("plant_id", plant_id).time(ts, WritePrecision.S)
-        for data_key, write_key in SNAPSHOT_POWER_FIELDS.items():
-            value = plant_snapshot.get(data_key) or 0.0
-            point.field(write_key, float(value) / 1000.0)  # old API used kW, not W
-        self.write_api.write("solarman", self.client.org, point)
-
-    @retry.retry(tries=10, delay=1, logger=logger)
+        fields = {write_key: data.get(data_key, 0.0) for data_key, write_key in DAY_SUMMARY_FIELDS.items()}
+        return DAY_SUMMARY_LINES.line(series, fields, timestamp)
+
+    def write_plant_snapshot(self, plant_id, plant_snapshot):
+        timestamp = int(plant_snapshot['lastUpdateTime'])
+        self.logger.info(f"Writing snapshot for {datetime.utcfromtimestamp(timestamp)}")
+        # old API used kW, not W; fields missing from a derived snapshot are left out rather than written as 0
+        fields = {write_key: float(plant_snapshot.get(data_key) or 0.0) / 1000.0
+                  for data_key, write_key in (SNAPSHOT_POWER_FIELDS | DAY_SNAPSHOT_POWER_FIELDS).items()
+                  if data_key in plant_snapshot}
+        self.write_lines([SNAPSHOT_POWER_LINES.line(SNAPSHOT_POWER_LINES.series(plant_id=plant_id), fields, timestamp)])
+
     def write_day_battery_charge_data(self, measurement_name, day_battery_charge_data):
         plant_id = day_battery_charge_data['plantId']
         chart_data = day_battery_charge_data["chartData"]
@@ -227,58 +558,375 @@ class InfluxDBWriter:
         # Strangely, epoch_millis is not UTC-based and there is a minutes-offset
         minllis = day_battery_charge_data['minllis']
 
+        points = []
         for epoch_millis, percent in chart_data:
             ts = datetime.utcfromtimestamp(int(epoch_millis) / 1000 - minllis*60)
             point = Point(measurement_name).tag("plant_id", plant_id).time(ts, WritePrecision.S)
             point.field("charge_pc", float(percent))
-            self.write_api.write("solarman", self.client.org, point)
+            points.append(point)
+        self.write_points(points)
 
 
 class SolarmanScraper:
 
     logger = logging.getLogger('SolarmanScraper')
 
-    def __init__(self, config):
+    # Seconds between collections of the snapshot and day data
+    collect_interval = 600
+    # Longest time between polls, each of which starts the collection tasks that are due
+    max_poll_interval = 30
+    interval = max_poll_interval
+
+    def __init__(self, config, pipeline: WritePipeline = None):
         self.config = config
 
         solarman_config = config["solarman"]
-        self.solarman = SolarmanClient(solarman_config["login"])
+        # Devices are fetched concurrently, up to max_workers at a time
+        max_workers = solarman_config.get("max_workers", 4)
+        # Login token and plant metadata are reused across restarts
+        self.cache = SessionCache(solarman_config.get("session_cache", ".solarman-session.json"))
+        self.solarman = SolarmanClient(solarman_config["login"], max_connections=max_workers, cache=self.cache,
+                                       breaker_config=solarman_config.get("circuit_breaker"))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="SolarmanScraper")
         self.plant_config = dict(solarman_config["plant"])
         self.plant_id = self.plant_config["plant_id"]
 
         # Get default config settings
         if "timezone" not in self.plant_config.keys():
-            plant_info = self.solarman.get_plant_info(self.plant_id)
-            self.plant_config["timezone"] = plant_info["region"]["timezone"]
+            self.plant_config["timezone"] = self.cached(
+                f"timezone:{self.plant_id}", lambda: self.solarman.get_plant_info(self.plant_id)["region"]["timezone"])
 
-        self.device_list = self.solarman.get_device_info(self.plant_id)
+        self.device_list = self.cached(f"devices:{self.plant_id}", lambda: self.solarman.get_device_info(self.plant_id))
         self.inverters = [d for d in self.device_list if d["deviceType"] == "INVERTER"]
 
         influxdb_config = config["influxdb"]
-        self.influxdb = InfluxDBWriter(influxdb_config)
-
+        self.influxdb = InfluxDBWriter(pipeline or WritePipeline(influxdb_config))
+
+        # Only samples newer than the last collectTime written (less an overlap for late corrections) are rewritten
+        self.full_day_rewrite = solarman_config.get("full_day_rewrite", False)
+        self.day_overlap = solarman_config.get("day_overlap_minutes", 30) * 60
+        self.day_watermarks = {}
+
+        # Hourly and daily energy totals are written alongside the day data unless turned off
+        self.rollups = solarman_config.get("rollups", True)
+
+        # Optionally poll when the inverter is next expected to report, less often while power is flat
+        adaptive_config = solarman_config.get("adaptive_polling")
+        self.schedule = AdaptiveSchedule(
+            base_interval=self.collect_interval,
+            min_interval=adaptive_config.get("min_interval_seconds", 120),
+            max_staleness=adaptive_config.get("max_staleness_minutes", 30) * 60,
+            margin=adaptive_config.get("margin_seconds", 60),
+            flat_watts=adaptive_config.get("flat_watts", 100)) if adaptive_config is not None else None
+
+        # Optionally write the snapshot from the day data, only calling realTime when that is out of date
+        self.snapshot_from_day_data = solarman_config.get("snapshot_from_day_data", False)
+        self.snapshot_max_age = solarman_config.get("snapshot_max_age_minutes", 15) * 60
+        self.day_snapshot_time = None
+
+        # Snapshot, day data and month summaries are collected by separate tasks, so that a failing endpoint
+        # only holds up the task using it
+        deadlines = {"snapshot": 120, "day": 480, "month": 600} | solarman_config.get("task_deadlines_seconds", {})
+        self.tasks = {
+            "snapshot": ScheduledTask("snapshot", self.snapshot_task, self.collect_interval, deadlines["snapshot"]),
+            "day": ScheduledTask("day", self.day_task, self.collect_interval, deadlines["day"]),
+            "month": ScheduledTask("month", self.month_task, MONTH_TASK_INTERVAL, deadlines["month"]),
+        }
+        self.task_executor = ThreadPoolExecutor(max_workers=len(self.tasks), thread_name_prefix="SolarmanTask")
+        # poll() only starts the tasks, so the supervisor judges liveness by when a task last completed a run
+        self.last_success = None
+        self.success_interval = max(self.collect_interval, self.schedule.max_staleness if self.schedule else 0) + \
+            max(deadlines["snapshot"], deadlines["day"])
+        self.last_month_day = None
+
+        self.checkpoints = CheckpointStore(config.get("checkpoints"))
+
+    def start(self):
+        self.today = date.today()
+        self.last_month_day = self.today - timedelta(1)
+        # Only load the whole month on a first run; otherwise process_day fills the daily summaries of the gap
+        if not self.has_checkpoints():
+            self.process_month(self.today)
+
+        for previous_day in self.backfill_days(self.today):
+            self.process_day(previous_day)
+        # Registered once started, as the supervisor builds a new scraper each time start() fails
+        metrics.REGISTRY.collector(self._collect_metrics)
+
+    def close(self):
+        """Releases the threads and database connection of a scraper that is being discarded."""
+        self.task_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.checkpoints.close()
+
+    def poll(self):
+        now = time.time()
+        for task in self.tasks.values():
+            if now < task.next_run:
+                continue
+            task.next_run = now + task.interval
+            if task.running():
+                self.logger.warning(f"The {task.name} task is still running, skipping this run")
+                TASK_RUNS.inc(task.name, "skipped")
+                continue
+            task.future = self.task_executor.submit(self.run_task, task)
+
+        next_run = min(task.next_run for task in self.tasks.values())
+        self.interval = min(max(next_run - time.time(), 1), self.max_poll_interval)
+
+    def run_task(self, task):
+        token = task_deadline.set(time.time() + task.deadline)
+        start = time.monotonic()
+        try:
+            task.run()
+            task.last_success = self.last_success = time.time()
+            TASK_RUNS.inc(task.name, "ok")
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            self.logger.warning(f"Abandoned the {task.name} task: {e}")
+            TASK_RUNS.inc(task.name, "abandoned")
+        except Exception:
+            self.logger.exception(f"The {task.name} task failed, it will run again at its next interval")
+            TASK_RUNS.inc(task.name, "failed")
+        finally:
+            TASK_SECONDS.observe(time.monotonic() - start, task.name)
+            task_deadline.reset(token)
+
+    def _collect_metrics(self):
+        return [("solarman_task_last_success_timestamp_seconds", "gauge",
+                 "When each Solarman collection task last completed a run",
+                 [({"task": task.name}, task.last_success) for task in self.tasks.values()
+                  if task.last_success is not None])]
+
+    def snapshot_task(self):
+        now = time.time()
+        if self.snapshot_from_day_data:
+            # The day task writes the snapshot while its newest sample is recent enough
+            if self.day_snapshot_time is not None and now - self.day_snapshot_time < self.snapshot_max_age:
+                return
+            self.logger.info("Day data is out of date, fetching snapshot")
+        plant_snapshot = self.process_snapshot()
+        reported = self.update_schedule(plant_snapshot)
+        if self.schedule is not None and not self.snapshot_from_day_data:
+            self.tasks["snapshot"].next_run = now + self.schedule.next_interval(time.time())
+            # A new report from the inverter brings the day data forward
+            if reported:
+                self.tasks["day"].next_run = min(self.tasks["day"].next_run, time.time())
+            self.logger.info(f"Next snapshot in {self.tasks['snapshot'].next_run - time.time():.0f}s")
+
+    def day_task(self):
+        # After a date roll do one last scan of the previous day for completeness
+        new_today = date.today()
+        if new_today != self.today:
+            self.process_day(self.today)
+            self.today = new_today
+
+        day_data_list = self.process_day(self.today)
+        now = time.time()
+        if self.snapshot_from_day_data:
+            # The newest sample of today's time series doubles as the snapshot, unless it is out of date
+            plant_snapshot = self.day_data_snapshot(day_data_list, now)
+            if plant_snapshot is not None:
+                self.influxdb.write_plant_snapshot(self.plant_id, plant_snapshot)
+                self.day_snapshot_time = plant_snapshot['lastUpdateTime']
+                self.update_schedule(plant_snapshot)
+
+        if self.schedule is not None:
+            # Otherwise the snapshot task brings the day data forward when the inverter reports
+            interval = self.schedule.next_interval(now) if self.snapshot_from_day_data else self.schedule.max_staleness
+            self.tasks["day"].next_run = now + interval
+            self.logger.info(f"Next day data in {interval:.0f}s")
+
+    def month_task(self):
+        # Once a day reload the month so far, picking up late corrections to its daily summaries
+        yesterday = date.today() - timedelta(1)
+        if yesterday != self.last_month_day:
+            self.process_month(yesterday)
+            self.last_month_day = yesterday
+
+    def update_schedule(self, plant_snapshot):
+        """Whether the snapshot is a new report from the inverter, always true without an adaptive schedule."""
+        return self.schedule is None or self.schedule.update(
+            plant_snapshot['lastUpdateTime'],
+            # Charge and discharge rather than the signed battery power, which depends on the snapshot's source
+            [float(plant_snapshot.get(key) or 0.0) for key in ['generationPower', 'chargePower', 'dischargePower']])
+
+    def day_data_snapshot(self, day_data_list, now):
+        """A plant snapshot like realTime's, summed over the newest day data sample of each inverter,
+        or None if any inverter's newest sample is older than snapshot_max_age. The signed battery and grid powers
+        are given as dayBatteryPower and dayGridPower instead of batteryPower and gridPower."""
+        plant_snapshot = dict.fromkeys(
+            [*SNAPSHOT_POWER_FIELDS.keys() - {'batteryPower', 'gridPower'}, *DAY_SNAPSHOT_POWER_FIELDS], 0.0)
+        plant_snapshot['lastUpdateTime'] = 0
+        for day_data in day_data_list:
+            if not day_data["paramDataList"]:
+                return None
+            newest = max(day_data["paramDataList"], key=lambda ts_entry: int(ts_entry["collectTime"]))
+            collect_time = int(newest["collectTime"])
+            if collect_time < now - self.snapshot_max_age:
+                return None
+            # Snapshot powers are in W, like realTime's
+            watts = {d["key"]: (float(d["value"]) * 1000.0 if d.get("unit") == 'kW' else float(d["value"]))
+                     for d in newest["dataList"]
+                     if d["key"] in DAY_DETAIL_FIELDS and "value" in d}
+            # Same signs as the day data: battery charging and grid export are positive
+            battery_power = watts.get('Pcg_dcg1', 0.0)
+            grid_power = watts.get('PG_Pt1', 0.0)
+            plant_snapshot['generationPower'] += watts.get('APo_t1', 0.0)
+            plant_snapshot['dayBatteryPower'] += battery_power
+            plant_snapshot['dayGridPower'] += grid_power
+            plant_snapshot['usePower'] += watts.get('E_Puse_t1', 0.0)
+            plant_snapshot['chargePower'] += max(battery_power, 0.0)
+            plant_snapshot['dischargePower'] += max(-battery_power, 0.0)
+            plant_snapshot['purchasePower'] += max(-grid_power, 0.0)
+            plant_snapshot['lastUpdateTime'] = max(plant_snapshot['lastUpdateTime'], collect_time)
+        return plant_snapshot if day_data_list else None
+
+    def cached(self, key, fetch):
+        value = self.cache.get(key, max_age=METADATA_MAX_AGE)
+        if value is None:
+            value = fetch()
+            self.cache.put(key, value)
+        return value
 
     def process_month(self, date):
         month_start = date.strftime("%Y-%m-01")
         month_end = date.strftime("%Y-%m-%d")
         self.logger.info(f"Processing data for month {month_start}")
-        for device in self.inverters:
-            month_data = self.solarman.get_daily_summary_data(device, month_start, month_end)
-            self.influxdb.write_daily_summary_data(self.plant_id, "solarman_daily_summary", month_data)
+        self.for_each_inverter(self.process_device_month, month_start, month_end)
+
+    def process_device_month(self, device, month_start, month_end):
+        month_data = self.solarman.get_daily_summary_data(device, month_start, month_end)
+        self.influxdb.write_daily_summary_data(self.plant_id, month_data)
 
-    def process_day(self, date):
+    def process_day(self, date, full=False):
         day = date.strftime("%Y-%m-%d")
         self.logger.info(f"Processing data for date {day}")
+        return self.for_each_inverter(self.process_device_day, date, full)
+
+    def process_device_day(self, device, date, full=False):
+        day = date.strftime("%Y-%m-%d")
+        day_data = self.solarman.get_day_data(device, day)
+        new_day_data = day_data if full or self.full_day_rewrite else self.new_day_data(day_data)
+        self.logger.info(f"Writing {len(new_day_data['paramDataList'])} of {len(day_data['paramDataList'])} "
+                         f"samples for device {day_data['deviceSn']}")
+        self.influxdb.write_day_chart_data(self.plant_id, new_day_data)
+        if self.rollups and new_day_data["paramDataList"]:
+            # Only the hours with new samples have changed, and the day
+            since = min(int(ts_entry["collectTime"]) for ts_entry in new_day_data["paramDataList"])
+            self.influxdb.write_day_rollups(self.plant_id, day_data, date, since)
+        day_summary_data = self.solarman.get_daily_summary_data(device, day, day)
+        self.influxdb.write_daily_summary_data(self.plant_id, day_summary_data)
+        self.update_day_watermark(day_data)
+        # A past day that came back empty may be an API or logger gap, so it is fetched again next time
+        complete = date < datetime.now().date() and bool(day_data["paramDataList"])
+        self.checkpoints.mark_day("solarman", day_data["deviceSn"], date, complete=complete)
+        return day_data
+
+    def backfill(self, start, end, rate):
+        """Load day chart and daily summary data from start to end inclusive, a month at a time,
+        skipping days already checkpointed so that an interrupted backfill resumes where it stopped."""
+        rate_limit = TokenBucket(rate)
+        month_start = start.replace(day=1)
+        while month_start <= end:
+            next_month_start = (month_start + timedelta(32)).replace(day=1)
+            self.backfill_month(max(start, month_start), min(end, next_month_start - timedelta(1)), rate_limit)
+            month_start = next_month_start
+
+    def backfill_month(self, first_day, last_day, rate_limit):
+        today = datetime.now().date()
+        # (checkpoint source, device, first day, last day) for each request needed
+        tasks = []
+        for device in self.inverters:
+            device_sn = device["deviceSn"]
+            days = set(daterange(first_day, last_day + timedelta(1)))
+            # One request covers the daily summaries of the whole month
+            if days - self.checkpoints.complete_days("solarman_summary", device_sn, first_day, last_day):
+                tasks.append(("solarman_summary", device, first_day, last_day))
+            for day in sorted(days - self.checkpoints.complete_days("solarman", device_sn, first_day, last_day)):
+                tasks.append(("solarman", device, day, day))
+        if not tasks:
+            self.logger.info(f"Backfill of {first_day} to {last_day} already complete")
+            return
+
+        self.logger.info(f"Backfilling {first_day} to {last_day} with {len(tasks)} requests")
+        undelivered = self.influxdb.pipeline.points_undelivered()
+        futures = {self.executor.submit(self.backfill_task, rate_limit, *task): task for task in tasks}
+        done = []
+        for future in as_completed(futures):
+            source, device, task_first_day, task_last_day = futures[future]
+            try:
+                if future.result():
+                    done.append(futures[future])
+                else:
+                    self.logger.warning(f"No day data for {task_first_day} for {device['deviceSn']}, it will be "
+                                        f"fetched again when the backfill is run again")
+            except Exception:
+                self.logger.exception(f"Backfill of {source} {task_first_day} to {task_last_day} for "
+                                      f"{device['deviceSn']} failed, it will be retried when the backfill is run again")
+
+        # Only checkpoint once the points are in InfluxDB, so nothing is skipped after a crash. Spooled points may
+        # yet be evicted, so if any point couldn't be written the whole month is left to the next backfill
+        self.influxdb.pipeline.flush()
+        if self.influxdb.pipeline.points_undelivered() != undelivered:
+            self.logger.warning(f"Not all points for {first_day} to {last_day} were written to InfluxDB, "
+                                f"they will be loaded again when the backfill is run again")
+            return
+        for source, device, task_first_day, task_last_day in done:
+            for day in daterange(task_first_day, task_last_day + timedelta(1)):
+                self.checkpoints.mark_day(source, device["deviceSn"], day, complete=day < today)
+        self.logger.info(f"Backfilled {len(done)} of {len(tasks)} requests for {first_day} to {last_day}")
+
+    def backfill_task(self, rate_limit, source, device, first_day, last_day):
+        """Whether the request returned data to checkpoint."""
+        rate_limit.acquire()
+        if source == "solarman_summary":
+            summary_data = self.solarman.get_daily_summary_data(
+                device, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"))
+            self.influxdb.write_daily_summary_data(self.plant_id, summary_data)
+            return True
+        day_data = self.solarman.get_day_data(device, first_day.strftime("%Y-%m-%d"))
+        self.influxdb.write_day_chart_data(self.plant_id, day_data)
+        if self.rollups:
+            self.influxdb.write_day_rollups(self.plant_id, day_data, first_day)
+        return bool(day_data["paramDataList"])
+
+    def for_each_inverter(self, fn, *args):
+        # One slow device doesn't hold up the others; each writes its points as soon as its responses arrive.
+        # Workers run in a copy of the caller's context, so the calling task's deadline applies to them too
+        futures = [self.executor.submit(contextvars.copy_context().run, fn, device, *args) for device in self.inverters]
+        return [future.result() for future in as_completed(futures)]
+
+    def backfill_days(self, today):
+        days = set()
         for device in self.inverters:
-            day_data = self.solarman.get_day_data(device, day)
-            self.influxdb.write_day_chart_data(self.plant_id, "solarman", day_data)
-            day_summary_data = self.solarman.get_daily_summary_data(device, day, day)
-            self.influxdb.write_daily_summary_data(self.plant_id, "solarman_daily_summary", day_summary_data)
+            days.update(self.checkpoints.backfill_days("solarman", device["deviceSn"], today, BACKFILL_DAYS))
+        return sorted(days)
+
+    def has_checkpoints(self):
+        return all(self.checkpoints.last_complete_day("solarman", device["deviceSn"]) for device in self.inverters)
+
+    def new_day_data(self, day_data):
+        watermark = self.day_watermarks.get(day_data["deviceSn"])
+        if watermark is None:
+            return day_data
+        since = watermark - self.day_overlap
+        return day_data | {
+            "paramDataList": [ts_entry for ts_entry in day_data["paramDataList"]
+                              if int(ts_entry["collectTime"]) > since]
+        }
+
+    def update_day_watermark(self, day_data):
+        device_sn = day_data["deviceSn"]
+        for ts_entry in day_data["paramDataList"]:
+            collect_time = int(ts_entry["collectTime"])
+            if collect_time > self.day_watermarks.get(device_sn, 0):
+                self.day_watermarks[device_sn] = collect_time
 
     def process_snapshot(self):
         self.logger.info(f"Processing snapshot")
         plant_snapshot = self.solarman.get_plant_snapshot(self.plant_id)
-        self.influxdb.write_plant_snapshot(self.plant_id, "solarman_power", plant_snapshot)
+        self.influxdb.write_plant_snapshot(self.plant_id, plant_snapshot)
+        return plant_snapshot
 
 
 def daterange(start_date, end_date):
@@ -288,41 +936,29 @@ def daterange(start_date, end_date):
 
 # @retry.retry(tries=10, delay=60)
 def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="Load historical data for a date range, resuming where an interrupted backfill stopped")
+    backfill_parser.add_argument("start", type=date.fromisoformat, help="First day to load, e.g. 2023-01-01")
+    backfill_parser.add_argument("end", type=date.fromisoformat, help="Last day to load (inclusive)")
+    backfill_parser.add_argument("--rate", type=float, default=1.0, help="Maximum API requests per second (default 1)")
+    args = parser.parse_args()
+
     with open(".solarman-scraper.yml", "r") as yamlfile:
         config = yaml.load(yamlfile, Loader=yaml.FullLoader)
     scraper = SolarmanScraper(config)
+    profiling.instrument(scraper, config.get("profiling"))
 
-    today = date.today()
-    scraper.process_month(today)
+    if args.command == "backfill":
+        scraper.backfill(args.start, args.end, args.rate)
+        return
 
-    backfill_days = 7
-    for previous_day in range(backfill_days, 0, -1):
-        scraper.process_day(today - timedelta(previous_day))
+    scraper.start()
 
     while True:
-
-        try:
-
-            # Get current values for now
-            scraper.process_snapshot()
-
-            new_today = date.today()
-
-            # After a date roll do one last scan of the previous day for completeness
-            if new_today != today:
-                scraper.process_day(today)
-                scraper.process_month(today)
-                today = new_today
-
-            # Get time series data for today
-            scraper.process_day(today)
-
-        except json.decoder.JSONDecodeError:
-            # Solarman returns HTML instead of JSON when logged out
-            scraper.solarman.login()
-            raise
-
-        time.sleep(600)
+        scraper.poll()
+        time.sleep(scraper.interval)
 
 
 if __name__ == '__main__':
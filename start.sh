@@ -3,7 +3,6 @@
 cd $(dirname $0)
 source ./venv/bin/activate
 
-for script in solarman-scraper zappi-scraper weather-scraper octopus-scraper kia-scraper; do
-  echo "Starting ${script}"
-  ./ka.sh python ./${script}.py > ./logs/${script}.log 2>&1 &
-done
+# All scrapers share one process; use start1.sh to run individual scrapers as separate processes
+echo "Starting supervisor"
+./ka.sh python ./supervisor.py > ./logs/supervisor.log 2>&1 &
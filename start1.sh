@@ -3,7 +3,8 @@
 cd $(dirname $0)
 source ./venv/bin/activate
 
+# Each script runs in its own supervisor process, which applies the script's restart policy and heartbeat
 for script in $*; do
   echo "Starting ${script}"
-  ./ka.sh python ./${script}.py > ./logs/${script}.log 2>&1 &
+  ./ka.sh python ./supervisor.py ${script} > ./logs/${script}.log 2>&1 &
 done
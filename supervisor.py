@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import yaml
+
+from influxdb_writer import WritePipeline
+import metrics
+import profiling
+
+FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+# Script name -> scraper class; each class provides interval, start() and poll(), and may provide close(), called
+# to release its resources when start() fails and the supervisor builds a new instance. A scraper whose poll() only
+# starts work in the background also provides last_success, when that work last succeeded (None until it has),
+# and success_interval, the longest it should take between successes
+SCRAPERS = {
+    "solarman-scraper": "SolarmanScraper",
+    "zappi-scraper": "ZappiScraper",
+    "weather-scraper": "MetOfficeScraper",
+    "octopus-scraper": "OctopusScraper",
+    "kia-scraper": "KiaScraper",
+}
+
+# Backoff after a scraper fails to start or poll, overridden per scraper by supervisor.restart_policies in the
+# configuration. Kia keeps a long fixed delay, as every login wakes the car and drains its 12V battery
+RESTART_POLICIES = {
+    "default": {"initial_delay_seconds": 10, "max_delay_seconds": 10 * 60, "jitter": 0.2},
+    "kia-scraper": {"initial_delay_seconds": 30 * 60, "max_delay_seconds": 30 * 60, "jitter": 0},
+}
+
+# Directory of the per-scraper liveness files
+HEARTBEAT_DIR = ".heartbeats"
+
+logger = logging.getLogger('Supervisor')
+
+CYCLE_SECONDS = metrics.REGISTRY.histogram("scraper_cycle_seconds", "Duration of each scraper poll", ("scraper",))
+CYCLE_FAILURES = metrics.REGISTRY.counter("scraper_cycle_failures_total", "Scraper polls that failed", ("scraper",))
+SCHEDULE_LAG = metrics.REGISTRY.histogram(
+    "scraper_schedule_lag_seconds", "How late each scraper poll started after its interval elapsed", ("scraper",))
+
+
+class RestartPolicy:
+    """Waits twice as long after each consecutive failure, from initial_delay up to max_delay, randomised by
+    up to +/- jitter of the delay so that scrapers failing together don't retry in step."""
+
+    def __init__(self, initial_delay, max_delay, jitter):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    @classmethod
+    def for_scraper(cls, name, supervisor_config):
+        overrides = supervisor_config.get("restart_policies") or {}
+        policy = RESTART_POLICIES["default"] | (overrides.get("default") or {}) | \
+            RESTART_POLICIES.get(name, {}) | (overrides.get(name) or {})
+        return cls(policy["initial_delay_seconds"], policy["max_delay_seconds"], policy["jitter"])
+
+    def delay(self, failures):
+        delay = min(self.max_delay, self.initial_delay * 2 ** min(failures - 1, 32))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class Heartbeat:
+    """A JSON file per scraper recording its last successful poll and when the next is due, rewritten after
+    every poll so that an external check can spot a hung loop without restarting healthy scrapers."""
+
+    def __init__(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.json")
+        self.state = {"scraper": name, "pid": os.getpid(), "state": "starting", "started": time.time(),
+                      "last_success": None, "next_poll": None, "success_due": None, "failures": 0}
+        self.write()
+
+    def beat(self, **changes):
+        self.state.update(changes)
+        self.write()
+
+    def write(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # e.g. a full disk; losing a heartbeat mustn't stop the scraper, or the others sharing its process
+            logger.exception(f"Failed to write heartbeat {self.path}")
+
+
+def check_heartbeats(directory, grace):
+    """Descriptions of the scrapers whose next poll, or next success of their background work, is more than grace
+    seconds overdue. Scrapers still starting are not checked, as a first run can backfill for a long time."""
+    stale = []
+    now = time.time()
+    for filename in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(directory, filename), "r") as f:
+            state = json.load(f)
+        last_success = time.ctime(state['last_success']) if state['last_success'] else 'never'
+        if state["next_poll"] is not None and now > state["next_poll"] + grace:
+            stale.append(f"{state['scraper']} (pid {state['pid']}) poll due {now - state['next_poll']:.0f}s ago, "
+                         f"last succeeded {last_success}")
+        elif state.get("success_due") is not None and now > state["success_due"] + grace:
+            stale.append(f"{state['scraper']} (pid {state['pid']}) success due {now - state['success_due']:.0f}s "
+                         f"ago, last succeeded {last_success}")
+    return stale
+
+
+def load_script(name):
+    """Import one of the hyphen-named scraper scripts in this directory as a module."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def sleep(seconds):
+    """Like asyncio.sleep(seconds) but shortening the sleep if the computer suspends and rewakes."""
+    finish_at = time.time() + seconds
+    while True:
+        time_remaining = finish_at - time.time()
+        if time_remaining <= 0:
+            return
+        await asyncio.sleep(min(time_remaining, 60))
+
+
+async def run_scraper(name, scraper_class, config, pipeline, policy, heartbeat):
+    # Scrapers use blocking HTTP clients, so their work runs in the default thread pool
+    failures = 0
+    while True:
+        scraper = None
+        try:
+            scraper = await asyncio.to_thread(scraper_class, config, pipeline)
+            profiling.instrument(scraper, config.get("profiling"))
+            await asyncio.to_thread(scraper.start)
+            break
+        except Exception:
+            failures += 1
+            delay = policy.delay(failures)
+            logger.exception(f"Failed to start {name}, retrying in {delay:.0f}s")
+            if hasattr(scraper, "close"):
+                try:
+                    scraper.close()
+                except Exception:
+                    logger.exception(f"Failed to close {name}")
+            heartbeat.beat(failures=failures)
+            await sleep(delay)
+
+    failures = 0
+    due = time.time()
+    # A poll that returns doesn't show a scraper working in the background is alive, its own last success does
+    background = hasattr(scraper, "last_success")
+    heartbeat.beat(state="running", next_poll=due, failures=0,
+                   success_due=due + scraper.success_interval if background else None)
+    while True:
+        try:
+            await asyncio.to_thread(poll, name, scraper, due)
+            failures = 0
+            delay = scraper.interval
+            if not background:
+                heartbeat.state["last_success"] = time.time()
+            elif scraper.last_success is not None:
+                heartbeat.state["last_success"] = scraper.last_success
+                heartbeat.state["success_due"] = scraper.last_success + scraper.success_interval
+        except Exception:
+            # A failed poll is retried with backoff, keeping the scraper's state, without affecting other scrapers
+            failures += 1
+            delay = policy.delay(failures)
+            logger.exception(f"Poll of {name} failed {failures} times in a row, retrying in {delay:.0f}s")
+        due = time.time() + delay
+        heartbeat.beat(next_poll=due, failures=failures)
+        await sleep(delay)
+
+
+def poll(name, scraper, due):
+    # Lag includes any wait for a free thread in the pool, as well as the sleep overrunning
+    started = time.time()
+    SCHEDULE_LAG.observe(max(0.0, started - due), name)
+    try:
+        scraper.poll()
+    except Exception:
+        CYCLE_FAILURES.inc(name)
+        raise
+    finally:
+        CYCLE_SECONDS.observe(time.time() - started, name)
+
+
+async def run(names, config):
+    if config.get("metrics"):
+        try:
+            metrics.serve(config["metrics"])
+        except OSError:
+            # e.g. start1.sh running several supervisors with the same configuration
+            logger.exception("Failed to serve metrics, continuing without them")
+    pipeline = WritePipeline(config["influxdb"])
+    supervisor_config = config.get("supervisor") or {}
+    heartbeat_dir = supervisor_config.get("heartbeat_dir", HEARTBEAT_DIR)
+    tasks = []
+    for name in names:
+        scraper_class = getattr(load_script(name), SCRAPERS[name])
+        policy = RestartPolicy.for_scraper(name, supervisor_config)
+        heartbeat = Heartbeat(heartbeat_dir, name)
+        tasks.append(asyncio.create_task(
+            run_scraper(name, scraper_class, config, pipeline, policy, heartbeat), name=name))
+    await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several scrapers in one process.")
+    parser.add_argument("scrapers", nargs="*", metavar="scraper",
+                        help=f"Scrapers to run, from {', '.join(SCRAPERS)} (default: all)")
+    parser.add_argument("--profile-cycles", type=int, metavar="N",
+                        help="Write a cProfile .pstats file for each of the first N scrape cycles of each scraper")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Periodically log the sites with the most allocation growth")
+    parser.add_argument("--check-heartbeats", type=float, nargs="?", const=300, metavar="GRACE",
+                        help="Instead of running scrapers, list those whose next poll is more than GRACE seconds "
+                             "overdue (default 300) and exit with status 1 if there are any")
+    args = parser.parse_args()
+    unknown = set(args.scrapers) - set(SCRAPERS)
+    if unknown:
+        parser.error(f"Unknown scrapers: {', '.join(sorted(unknown))}")
+    names = args.scrapers or list(SCRAPERS)
+
+    with open(".solarman-scraper.yml", "r") as yamlfile:
+        config = yaml.load(yamlfile, Loader=yaml.FullLoader)
+    if args.check_heartbeats is not None:
+        stale = check_heartbeats((config.get("supervisor") or {}).get("heartbeat_dir", HEARTBEAT_DIR),
+                                 args.check_heartbeats)
+        for description in stale:
+            print(description)
+        sys.exit(1 if stale else 0)
+    if args.profile_cycles is not None or args.tracemalloc:
+        config["profiling"] = dict(config.get("profiling") or {})
+        if args.profile_cycles is not None:
+            config["profiling"]["cycles"] = args.profile_cycles
+        if args.tracemalloc:
+            config["profiling"]["tracemalloc"] = True
+    asyncio.run(run(names, config))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,16 @@
 import time
 import yaml
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import logging
 import retry
 import requests
-from cachetools import TTLCache
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client import WritePrecision
+
+from influxdb_writer import WritePipeline
+from line_protocol import LineSerializer
+import metrics
+import profiling
 
 FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
@@ -96,82 +99,159 @@ FIELDS = {
     }
 }
 
+# Line protocol for each forecast measurement, tagged by location
+FIELD_LINES = {measurement_name: LineSerializer(measurement_name, ["location"], fields)
+               for measurement_name, fields in FIELDS.items()}
+
+
 class MetOfficeClient:
 
     logger = logging.getLogger('MetOfficeClient')
 
-    cache = TTLCache(maxsize=10, ttl=600)
-
     def __init__(self, longitude, latitude, credentials):
         self.longitude = longitude
         self.latitude = latitude
         self.credentials = credentials
+        self.session = requests.session()
+        # path -> conditional request headers built from the last response's ETag/Last-Modified
+        self.validators = {}
 
     @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @metrics.timed
     def get_forecast(self, path):
+        """The forecast for path, or None if it hasn't changed since it was last fetched."""
+        url = f"https://data.hub.api.metoffice.gov.uk/sitespecific/v0/point/{path}"
+        # url = f"https://api-metoffice.apiconnect.ibmcloud.com/metoffice/production/v0/forecasts/point/{path}"
+        params = {
+            "latitude": self.latitude,
+            "longitude": self.longitude
+        }
+        headers = {
+            "accept": "application/json",
+            "apikey": self.credentials['apikey']
+            # "x-ibm-client-id": self.credentials['clientId'],
+            # "x-ibm-client-secret": self.credentials['secret']
+        }
+        response = self.session.get(url, params=params, headers=headers | self.validators.get(path, {}), timeout=60)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        validators = {}
+        if "ETag" in response.headers:
+            validators["If-None-Match"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            validators["If-Modified-Since"] = response.headers["Last-Modified"]
+        self.validators[path] = validators
+        return response.json()
+
 
-        result = self.cache.get(path)
-        if not result:
+class ModelRunSchedule:
+    """Learns how often a forecast product is updated from the modelRunDate of its responses,
+    so that it can be polled just after the next run is published."""
 
-            url = f"https://data.hub.api.metoffice.gov.uk/sitespecific/v0/point/{path}"
-            # url = f"https://api-metoffice.apiconnect.ibmcloud.com/metoffice/production/v0/forecasts/point/{path}"
-            params = {
-                "latitude": self.latitude,
-                "longitude": self.longitude
-            }
-            headers = {
-                "accept": "application/json",
-                "apikey": self.credentials['apikey']
-                # "x-ibm-client-id": self.credentials['clientId'],
-                # "x-ibm-client-secret": self.credentials['secret']
-            }
-            response = requests.get(url, params=params, headers=headers)
-            result = response.json()
-            self.cache[path] = result
+    def __init__(self, default_interval, margin, overdue_interval, max_interval):
+        self.default_interval = default_interval
+        self.margin = margin
+        self.overdue_interval = overdue_interval
+        self.max_interval = max_interval
+        self.last_run = None
+        self.cadence = None  # shortest time seen between runs
+        self.delay = None    # shortest time seen between a run and it being available
 
-        return result
+    def update(self, model_run: datetime, now: datetime):
+        """Records the run in a response, returning whether it is a new run."""
+        if model_run == self.last_run:
+            return False
+        if self.last_run is not None and model_run > self.last_run:
+            gap = model_run - self.last_run
+            self.cadence = gap if self.cadence is None else min(self.cadence, gap)
+        delay = max(now - model_run, timedelta(0))
+        self.delay = delay if self.delay is None else min(self.delay, delay)
+        self.last_run = model_run
+        return True
+
+    def next_poll(self, now: datetime):
+        if self.cadence is None:
+            return now + self.default_interval
+        expected = self.last_run + self.cadence + self.delay + self.margin
+        if expected <= now:
+            # Run is late, keep checking until it shows up
+            expected = now + self.overdue_interval
+        return min(expected, now + self.max_interval)
 
 
 class InfluxDBWriter:
 
     logger = logging.getLogger('InfluxDBWriter')
 
-    def __init__(self, influxdb_config):
-        self.influxdb_config = influxdb_config
-        self.client = InfluxDBClient(**influxdb_config)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+    def __init__(self, pipeline: WritePipeline):
+        self.pipeline = pipeline
 
-    @retry.retry(tries=10, delay=1, logger=logger)
     def write_data(self, measurement_name, location_name, data):
         time_series = data["features"][0]["properties"]["timeSeries"]
+        serializer = FIELD_LINES[measurement_name]
+        series = serializer.series(location=location_name)
+        lines = []
         for ts_entry in time_series:
-            ts = datetime.strptime(ts_entry["time"], "%Y-%m-%dT%H:%M%z")
-            point = Point(measurement_name).tag("location", location_name).time(ts, WritePrecision.S)
-            for key, field_type in FIELDS[measurement_name].items():
-                point.field(key, field_type(ts_entry.get(key, 0)))
-            self.write_api.write("met_office", self.client.org, point)
+            timestamp = int(datetime.strptime(ts_entry["time"], "%Y-%m-%dT%H:%M%z").timestamp())
+            fields = {key: field_type(ts_entry.get(key, 0)) for key, field_type in FIELDS[measurement_name].items()}
+            lines.append(serializer.line(series, fields, timestamp))
+        self.pipeline.write_lines("met_office", WritePrecision.S, lines)
 
 
 class MetOfficeScraper:
 
     logger = logging.getLogger('MetOfficeScraper')
 
-    def __init__(self, config):
+    FORECASTS = ["hourly", "three-hourly", "daily"]
+
+    # Seconds until the next poll; recalculated after each poll from the forecasts' model run schedules
+    interval = 60*60
+
+    def __init__(self, config, pipeline: WritePipeline = None):
         metoffice_config = config["met_office"]
         self.metoffice_client = MetOfficeClient(
             metoffice_config["longitude"],
             metoffice_config["latitude"],
             metoffice_config["credentials"])
         self.location = metoffice_config["location"]
+        self.schedules = {
+            forecast: ModelRunSchedule(
+                default_interval=timedelta(hours=1),
+                margin=timedelta(minutes=metoffice_config.get("poll_margin_minutes", 5)),
+                overdue_interval=timedelta(minutes=15),
+                max_interval=timedelta(hours=6))
+            for forecast in self.FORECASTS
+        }
+        self.next_polls = {}
 
         influxdb_config = config["influxdb"]
-        self.influxdb = InfluxDBWriter(influxdb_config)
+        self.influxdb = InfluxDBWriter(pipeline or WritePipeline(influxdb_config))
+
+    def start(self):
+        # Forecasts have no history to backfill
+        pass
+
+    def poll(self):
+        now = datetime.now(tz=timezone.utc)
+        self.process_snapshot([forecast for forecast in self.FORECASTS if self.next_polls.get(forecast, now) <= now])
+        self.interval = max(60, (min(self.next_polls.values()) - datetime.now(tz=timezone.utc)).total_seconds())
+        self.logger.info(f"Next poll in {self.interval:.0f}s")
 
-    def process_snapshot(self):
-        for forecast in ["hourly", "three-hourly", "daily"]:
+    def process_snapshot(self, forecasts=FORECASTS):
+        for forecast in forecasts:
             logging.info(f"Getting {forecast} data")
             response = self.metoffice_client.get_forecast(forecast)
-            self.influxdb.write_data(forecast, self.location, response)
+            now = datetime.now(tz=timezone.utc)
+            if response is None:
+                self.logger.info(f"{forecast} forecast not modified")
+            else:
+                model_run = datetime.strptime(response["features"][0]["properties"]["modelRunDate"], "%Y-%m-%dT%H:%M%z")
+                if self.schedules[forecast].update(model_run, now):
+                    self.influxdb.write_data(forecast, self.location, response)
+                else:
+                    self.logger.info(f"{forecast} forecast still from model run {model_run}")
+            self.next_polls[forecast] = self.schedules[forecast].next_poll(now)
 
 
 @retry.retry(tries=10, delay=60)
@@ -179,10 +259,12 @@ def main():
     with open(".solarman-scraper.yml", "r") as yamlfile:
         config = yaml.load(yamlfile, Loader=yaml.FullLoader)
     scraper = MetOfficeScraper(config)
+    profiling.instrument(scraper, config.get("profiling"))
+    scraper.start()
 
     while True:
-        scraper.process_snapshot()
-        time.sleep(60*60)
+        scraper.poll()
+        time.sleep(scraper.interval)
 
 
 if __name__ == '__main__':
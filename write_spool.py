@@ -0,0 +1,171 @@
+import glob
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote, unquote
+
+# Segments left mid-drain by a process that died are returned to the spool after this many seconds
+STALE_DRAIN_SECONDS = 600
+
+# Segments open for appending by any spool in this process, which may share a directory with another spool
+_open_segments = set()
+
+
+class WriteSpool:
+    """Append-only segment files of line protocol, holding points until InfluxDB can accept them again.
+
+    Segments are named so that sorting by name gives oldest first, and each holds lines for one bucket and
+    write precision. The spool directory may be shared by several scraper processes: segments are written with
+    an .open suffix, which is only removed once the process writing them has closed them, and only closed
+    segments are drained or evicted."""
+
+    logger = logging.getLogger('WriteSpool')
+
+    def __init__(self, path=".write-spool", max_bytes=100 * 1024 * 1024, segment_bytes=4 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.active = {}  # (bucket, precision) -> open segment file
+        self.points_spooled = 0
+        self.points_replayed = 0
+        self.points_evicted = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._recover()
+
+    def append(self, bucket, precision, lines):
+        with self.lock:
+            segment = self.active.get((bucket, precision))
+            if segment is None:
+                name = f"{time.time_ns():020d}-{os.getpid()}.{precision}.{quote(bucket, safe='')}.lp.open"
+                segment = self.active[(bucket, precision)] = open(os.path.join(self.path, name), "a")
+                _open_segments.add(segment.name)
+            segment.write("\n".join(lines) + "\n")
+            # One fsync per batch of points, not per point
+            segment.flush()
+            os.fsync(segment.fileno())
+            self.points_spooled += len(lines)
+            if segment.tell() >= self.segment_bytes:
+                self._close(self.active.pop((bucket, precision)))
+            self._evict()
+
+    def pending(self):
+        return bool(self.active) or bool(self._segment_paths())
+
+    def size(self):
+        """Bytes in open and closed segments, leaving out those being drained, which are about to be removed."""
+        size = 0
+        for path in glob.glob(os.path.join(self.path, "*.lp")) + glob.glob(os.path.join(self.path, "*.lp.open")):
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                # Drained or evicted by another process meanwhile
+                pass
+        return size
+
+    def drain(self, write, batch_size):
+        """Replay spooled segments oldest first through write(bucket, precision, lines), deleting each once written.
+
+        Raises the first write error, leaving that segment and newer ones in the spool."""
+        # Segments started after this are left for the next drain
+        with self.lock:
+            self._close_active()
+            self._recover()
+        paths = self._segment_paths()
+        for path in paths:
+            # Claim the segment, in case another process is draining the same spool
+            draining_path = f"{path}.draining"
+            try:
+                os.rename(path, draining_path)
+            except FileNotFoundError:
+                continue
+            _, precision, bucket = os.path.basename(path)[:-len(".lp")].split(".", 2)
+            with open(draining_path, "r") as f:
+                lines = f.read().splitlines()
+            try:
+                for start in range(0, len(lines), batch_size):
+                    write(unquote(bucket), precision, lines[start:start + batch_size])
+            except Exception:
+                # Rewriting lines already sent is harmless, InfluxDB keeps the last value for a point
+                os.rename(draining_path, path)
+                raise
+            os.remove(draining_path)
+            self.points_replayed += len(lines)
+            self.logger.info(f"Replayed {len(lines)} spooled points to {unquote(bucket)}")
+
+    def _recover(self):
+        """Return segments left behind by processes that died to the spool: open segments of processes no longer
+        running, and segments claimed for draining long ago. Segments claimed for eviction long ago are removed."""
+        for open_path in glob.glob(os.path.join(self.path, "*.lp.open")):
+            pid = int(os.path.basename(open_path).split(".", 1)[0].split("-")[1])
+            # A segment named with this process's pid but not open in it was left by an earlier process
+            if open_path in _open_segments if pid == os.getpid() else is_running(pid):
+                continue
+            try:
+                os.rename(open_path, open_path[:-len(".open")])
+            except FileNotFoundError:
+                pass
+        for draining_path in glob.glob(os.path.join(self.path, "*.draining")):
+            try:
+                if os.path.getmtime(draining_path) < time.time() - STALE_DRAIN_SECONDS:
+                    os.rename(draining_path, draining_path[:-len(".draining")])
+            except FileNotFoundError:
+                pass
+        for evicting_path in glob.glob(os.path.join(self.path, "*.evicting")):
+            try:
+                if os.path.getmtime(evicting_path) < time.time() - STALE_DRAIN_SECONDS:
+                    os.remove(evicting_path)
+            except FileNotFoundError:
+                pass
+
+    def _discard(self, path):
+        # Claimed first, so a segment another process is draining isn't counted as evicted
+        evicting_path = f"{path}.evicting"
+        os.rename(path, evicting_path)
+        with open(evicting_path, "r") as f:
+            lines = sum(1 for _ in f)
+        os.remove(evicting_path)
+        return lines
+
+    def _segment_paths(self):
+        """Closed segments, oldest first."""
+        return sorted(glob.glob(os.path.join(self.path, "*.lp")))
+
+    def _close(self, segment):
+        segment.close()
+        os.rename(segment.name, segment.name[:-len(".open")])
+        _open_segments.discard(segment.name)
+
+    def _close_active(self):
+        for segment in self.active.values():
+            self._close(segment)
+        self.active = {}
+
+    def _evict(self):
+        size = self.size()
+        if size <= self.max_bytes:
+            return
+        for path in self._segment_paths():
+            if size <= self.max_bytes:
+                break
+            try:
+                segment_size = os.path.getsize(path)
+                lines = self._discard(path)
+            except FileNotFoundError:
+                # Claimed by another process
+                continue
+            size -= segment_size
+            self.points_evicted += lines
+            self.logger.warning(f"Spool exceeds {self.max_bytes} bytes, discarded {lines} oldest points in {path}")
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        return True
+    return True
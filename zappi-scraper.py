@@ -1,15 +1,25 @@
+import calendar
 import time
+from array import array
 
 import yaml
-from datetime import datetime, timedelta, date, timezone
+from datetime import datetime, timedelta, date
 
 import logging
 import retry
 import requests
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client import Point, WritePrecision
 from requests.auth import HTTPDigestAuth
 
+from checkpoints import CheckpointStore
+from influxdb_writer import WritePipeline
+from line_protocol import escape_tag_value, format_float
+import metrics
+import profiling
+
+# Days loaded on a first run, before any checkpoints exist
+BACKFILL_DAYS = 1
+
 FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
@@ -28,46 +38,79 @@ class MyEnergiClient:
         response.raise_for_status()
         self.asn = response.headers['X_MYENERGI-asn']
 
+    @metrics.timed
     def get_zappi_serial(self):
         response = requests.get(f"https://{self.asn}/cgi-jstatus-Z", auth=self.auth)
         zappi_status = response.json()
         return zappi_status["zappi"][0]["sno"]
 
     @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @metrics.timed
     def get_snapshot(self):
         response = requests.get(f"https://{self.asn}/cgi-jstatus-Z", auth=self.auth)
         zappi_status = response.json()
         return zappi_status["zappi"][0]
 
     @retry.retry(tries=10, delay=1, backoff=2, logger=logger)
+    @metrics.timed
     def get_day_data(self, zappi_serial: str, date: str):
         response = self.session.get(f"https://{self.asn}/cgi-jday-Z{zappi_serial}-{date}", auth=self.auth)
-        result = []
-        for item in response.json()[f"U{zappi_serial}"]:
-            minute = item.get("min", 0)
-            hour = item.get("hr", 0)
-            day = item.get("dom", 0)
-            month = item.get("mon", 0)
-            year = item.get("yr", 0)
-            timestamp = datetime(year, month, day, hour, minute, 0, tzinfo=timezone.utc)
-            volts = item.get("v1", 0) / 10.0
-            energy = (item.get("h1d", 0) + item.get("h2d", 0) + item.get("h3d", 0) +
-                      item.get("h1b", 0) + item.get("h2b", 0) + item.get("h3b", 0))
-            watts = (energy / volts) * 4
-            result.append({"ts": timestamp, "voltage": volts, "power": watts, "zappi_serial": zappi_serial})
-        return result
+        return ZappiDayData.from_items(zappi_serial, response.json()[f"U{zappi_serial}"])
+
+
+class ZappiDayData:
+    """A day of per-minute Zappi readings, held as columns rather than a dict per minute."""
+
+    ENERGY_KEYS = ["h1d", "h2d", "h3d", "h1b", "h2b", "h3b"]
+
+    def __init__(self, zappi_serial, timestamps: array, volts: array, energy: array):
+        self.zappi_serial = zappi_serial
+        self.timestamps = timestamps  # epoch seconds
+        self.volts = volts
+        self.energy = energy  # joules per minute, summed over the diverted and boosted phases
+
+    @classmethod
+    def from_items(cls, zappi_serial, items):
+        # Readings are all from one day (or two around midnight), so each day's epoch is worked out once
+        day_starts = {}
+        for item in items:
+            day = (item.get("yr", 0), item.get("mon", 0), item.get("dom", 0))
+            if day not in day_starts:
+                day_starts[day] = calendar.timegm(date(*day).timetuple())
+        timestamps = array("q", [
+            day_starts[(item.get("yr", 0), item.get("mon", 0), item.get("dom", 0))]
+            + item.get("hr", 0) * 3600 + item.get("min", 0) * 60
+            for item in items])
+        volts = array("d", [item.get("v1", 0) / 10.0 for item in items])
+        energy = array("d", [sum(item.get(key, 0) for key in cls.ENERGY_KEYS) for item in items])
+        return cls(zappi_serial, timestamps, volts, energy)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def watts(self):
+        # Joules per minute over volts, times 4 to calibrate against the Zappi's own readings
+        return array("d", [(energy / volts) * 4 for energy, volts in zip(self.energy, self.volts)])
+
+    def to_line_protocol(self):
+        """Lines in second precision, identical to those from a Point per minute with power and voltage fields."""
+        series = f"zappi,zappi_serial={escape_tag_value(self.zappi_serial)} "
+        lines = []
+        for timestamp, watts, volts in zip(self.timestamps, self.watts(), self.volts):
+            fields = [f"{key}={value}" for key, value in (("power", format_float(watts)), ("voltage", format_float(volts)))
+                      if value is not None]
+            if fields:
+                lines.append(f"{series}{','.join(fields)} {timestamp}")
+        return lines
 
 
 class InfluxDBWriter:
 
     logger = logging.getLogger('InfluxDBWriter')
 
-    def __init__(self, influxdb_config):
-        self.influxdb_config = influxdb_config
-        self.client = InfluxDBClient(**influxdb_config)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+    def __init__(self, pipeline: WritePipeline):
+        self.pipeline = pipeline
 
-    @retry.retry(tries=10, delay=1, logger=logger)
     def write_snapshot(self, snapshot):
         zappi_serial = snapshot['sno']
         day, month, year = snapshot['dat'].split("-")
@@ -76,33 +119,48 @@ class InfluxDBWriter:
         point = Point("zappi").tag("zappi_serial", zappi_serial).time(ts, WritePrecision.S)
         point.field("power", float(snapshot["div"]))
         point.field("voltage", float(snapshot["vol"]))
-        self.write_api.write("myenergi", self.client.org, point)
+        self.pipeline.write("myenergi", [point])
 
-    @retry.retry(tries=10, delay=1, logger=logger)
-    def write_day_chart_data(self, zappi_data):
-        for ts_entry in zappi_data:
-            ts = ts_entry["ts"]
-            point = Point("zappi").tag("zappi_serial", ts_entry["zappi_serial"]).time(ts, WritePrecision.S)
-            for key in ["voltage", "power"]:
-                point.field(key, ts_entry.get(key, 0.0))
-            self.write_api.write("myenergi", self.client.org, point)
+    def write_day_chart_data(self, zappi_data: ZappiDayData):
+        self.pipeline.write_lines("myenergi", WritePrecision.S, zappi_data.to_line_protocol())
 
 
 class ZappiScraper:
 
     logger = logging.getLogger('ZappiScraper')
 
-    def __init__(self, config):
+    # Seconds between polls
+    interval = 60
+
+    def __init__(self, config, pipeline: WritePipeline = None):
         self.config = config
 
         login_config = config["myenergi"]
         self.myenergi = MyEnergiClient(login_config)
 
         influxdb_config = config["influxdb"]
-        self.influxdb = InfluxDBWriter(influxdb_config)
+        self.influxdb = InfluxDBWriter(pipeline or WritePipeline(influxdb_config))
 
         self.zappi_serial = self.myenergi.get_zappi_serial()
 
+        self.checkpoints = CheckpointStore(config.get("checkpoints"))
+
+    def start(self):
+        self.today = date.today()
+        for previous_day in self.backfill_days(self.today):
+            self.process_day(previous_day)
+
+    def poll(self):
+        new_today = date.today()
+
+        # After a date roll do one last scan of the previous day for completeness
+        if new_today != self.today:
+            self.process_day(self.today)
+            self.today = new_today
+
+        # Get current value
+        self.process_snapshot()
+
     def process_snapshot(self):
         self.logger.info(f"Processing snapshot")
         snapshot = self.myenergi.get_snapshot()
@@ -112,6 +170,10 @@ class ZappiScraper:
         self.logger.info(f"Processing data for date {date}")
         day_data = self.myenergi.get_day_data(self.zappi_serial, date.strftime("%Y-%m-%d"))
         self.influxdb.write_day_chart_data(day_data)
+        self.checkpoints.mark_day("zappi", self.zappi_serial, date, complete=date < datetime.now().date())
+
+    def backfill_days(self, today):
+        return self.checkpoints.backfill_days("zappi", self.zappi_serial, today, BACKFILL_DAYS)
 
 def daterange(start_date, end_date):
     for n in range(int((end_date - start_date).days)):
@@ -123,24 +185,12 @@ def main():
     with open(".solarman-scraper.yml", "r") as yamlfile:
         config = yaml.load(yamlfile, Loader=yaml.FullLoader)
     scraper = ZappiScraper(config)
-
-    today = date.today()
-    backfill_days = 1
-    for previous_day in range(backfill_days, 0, -1):
-        scraper.process_day(today - timedelta(previous_day))
+    profiling.instrument(scraper, config.get("profiling"))
+    scraper.start()
 
     while True:
-
-        new_today = date.today()
-
-        # After a date roll do one last scan of the previous day for completeness
-        if new_today != today:
-            scraper.process_day(today)
-            today = new_today
-
-        # Get current value
-        scraper.process_snapshot()
-        time.sleep(60)
+        scraper.poll()
+        time.sleep(scraper.interval)
 
 
 if __name__ == '__main__':